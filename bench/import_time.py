@@ -0,0 +1,63 @@
+"""
+Import time benchmark for qtools.
+
+Each module is imported in a fresh interpreter several times, and the median time
+taken by the import is reported along with whether it loaded gi (GStreamer and
+libnotify), which should only happen once a notification or sound is used.
+
+Usage:
+
+    python bench/import_time.py [--runs N] [module ...]
+
+"""
+
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = (
+    'qtools', 'qtools.focus', 'qtools.borders', 'qtools.xresources', 'qtools.mpc',
+    'qtools.notification',
+)
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {0}
+print(json.dumps([time.perf_counter() - start, 'gi' in sys.modules]))
+"""
+
+
+def time_import(module):
+    output = subprocess.run(
+        [sys.executable, '-c', _SCRIPT.format(module)], cwd=ROOT, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True,
+    )
+    return json.loads(output.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark importing qtools.')
+    parser.add_argument('modules', nargs='*', help='Modules to import.')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per module.')
+    args = parser.parse_args()
+
+    print('{0:<22} {1:>9} {2:>9} {3:>5}'.format('module', 'p50 ms', 'max ms', 'gi'))
+    for module in args.modules or MODULES:
+        times = []
+        for _ in range(args.runs):
+            elapsed, gi = time_import(module)
+            times.append(elapsed * 1000)
+        times.sort()
+        print('{0:<22} {1:>9.1f} {2:>9.1f} {3:>5}'.format(
+            module, times[len(times) // 2], times[-1], 'yes' if gi else 'no',
+        ))
+
+
+if __name__ == '__main__':
+    main()
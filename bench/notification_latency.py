@@ -0,0 +1,323 @@
+"""
+Latency benchmark for qtools.notification.
+
+This drives a notification Server with scripted workloads on a real X display,
+without Qtile or D-Bus. A stand-in for libqtile.notify.notifier passes notifications
+straight to the Server as they would arrive from the bus, and a minimal stand-in for
+the Qtile manager runs the Server's callbacks on an asyncio loop.
+
+For each notification, latency is measured from receipt until the X server has
+processed every request made while handling it, which for a drawn notification means
+its popup is mapped and painted. The X requests made per notification are counted
+using the sequence numbers of the connection.
+
+Usage:
+
+    python bench/notification_latency.py [--count N] [--xvfb] [workload ...]
+
+With --xvfb, or if DISPLAY is not set, a private Xvfb server is started. Available
+workloads are burst, coalesce, replace, progress, icons and history.
+
+"""
+
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cairocffi
+from libqtile.notify import Notification
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class LocalNotifier:
+    """
+    Stands in for libqtile.notify.notifier without connecting to D-Bus.
+    """
+    def __init__(self):
+        self.notifications = []
+        self.callbacks = []
+
+    def register(self, callback, capabilities=None):
+        self.callbacks.append(callback)
+
+    def add(self, notif):
+        self.notifications.append(notif)
+        notif.id = len(self.notifications)
+        for callback in self.callbacks:
+            callback(notif)
+        return notif.id
+
+
+class Screen:
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+
+class LocalQtile:
+    """
+    Stands in for the Qtile manager with the parts used by Popup and Server.
+    """
+    def __init__(self, conn, loop):
+        self.conn = conn
+        self.windows_map = {}
+        self.current_window = None
+        self.mouse_position = (0, 0)
+        root = conn.default_screen
+        self.screens = [Screen(0, 0, root.width_in_pixels, root.height_in_pixels)]
+        self.current_screen = self.screens[0]
+        self._loop = loop
+
+    def find_screen(self, x, y):
+        return self.current_screen
+
+    def call_soon(self, func, *args):
+        def f():
+            func(*args)
+            self.conn.flush()
+        return self._loop.call_soon(f)
+
+    def call_later(self, delay, func, *args):
+        def f():
+            func(*args)
+            self.conn.flush()
+        return self._loop.call_later(delay, f)
+
+    def run_in_executor(self, func, *args):
+        return self._loop.run_in_executor(None, func, *args)
+
+
+def start_xvfb():
+    """
+    Start a private Xvfb server and return the process and its display name.
+    """
+    read, write = os.pipe()
+    proc = subprocess.Popen(
+        ['Xvfb', '-displayfd', str(write), '-screen', '0', '1920x1080x24',
+         '-nolisten', 'tcp'],
+        pass_fds=(write,), stderr=subprocess.DEVNULL,
+    )
+    os.close(write)
+    with os.fdopen(read) as f:
+        number = f.readline().strip()
+    if not number:
+        proc.kill()
+        sys.exit('Xvfb failed to start')
+    return proc, ':' + number
+
+
+class Bench:
+    def __init__(self, conn, loop, module, count):
+        self.conn = conn
+        self.loop = loop
+        self.module = module
+        self.count = count
+        self.tmp = tempfile.mkdtemp(prefix='qtools-bench-')
+        self.server = None
+        self.notifier = None
+
+    def setup(self, history=(), **config):
+        """
+        Make a fresh Server for a workload, optionally starting with some history.
+        """
+        self.notifier = LocalNotifier()
+        self.notifier.notifications.extend(history)
+        self.module.notifier = self.notifier
+        config.setdefault('timeout', 600000)
+        config.setdefault(
+            'history_file', os.path.join(tempfile.mkdtemp(dir=self.tmp), 'history')
+        )
+        self.server = self.module.Server(**config)
+        self.server.configure()
+        self.settle()
+
+    def teardown(self):
+        server = self.server
+        server.close_all()
+        self.settle()
+        for popup in list(server._hidden):
+            server._evict(popup)
+        server._timers.clear()
+        server._history.close()
+        self.settle()
+
+    def settle(self):
+        """
+        Run pending callbacks then wait for the X server to process every request.
+        Returns the sequence number of the request used to wait.
+        """
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.conn.flush()
+        cookie = self.conn.conn.core.GetInputFocus()
+        cookie.reply()
+        return cookie.sequence
+
+    def measure(self, func, *args):
+        """
+        Run func and return the time taken until the X server has caught up, and the
+        number of X requests made.
+        """
+        before = self.settle()
+        start = time.perf_counter()
+        func(*args)
+        after = self.settle()
+        return time.perf_counter() - start, after - before - 1
+
+    def make_room(self):
+        """
+        Close the oldest popup if no more can be shown, so that notifications are
+        drawn rather than queued.
+        """
+        if len(self.server._shown) >= self.server.max_windows:
+            self.server.close()
+            self.settle()
+
+    def notify(self, notif):
+        return self.measure(self.notifier.add, notif)
+
+    def burst(self):
+        self.setup(coalesce_window=0)
+        for i in range(self.count):
+            self.make_room()
+            yield self.notify(Notification(
+                'Burst {0}'.format(i), 'Message body number {0}'.format(i),
+                app_name='bench',
+            ))
+
+    def coalesce(self):
+        self.setup(coalesce_window=60000)
+        for i in range(self.count):
+            yield self.notify(Notification(
+                'Coalesce', 'Message body number {0}'.format(i), app_name='bench',
+            ))
+
+    def replace(self):
+        # Every update is drawn so that each one is measured.
+        self.setup(replace_interval=0)
+        nid = self.notifier.add(Notification('Replace', 'start'))
+        for i in range(self.count):
+            yield self.notify(Notification(
+                'Replace', 'Message body number {0}'.format(i), replaces_id=nid,
+            ))
+
+    def progress(self):
+        self.setup(replace_interval=0)
+        nid = self.notifier.add(Notification('Progress', '', hints={'value': 0}))
+        for i in range(self.count):
+            hints = {'value': i % 101}
+            yield self.notify(Notification(
+                'Progress', '', hints=hints, replaces_id=nid,
+            ))
+
+    def icons(self):
+        paths = []
+        for size in (32, 64, 128, 256, 512, 1024):
+            surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, size, size)
+            ctx = cairocffi.Context(surface)
+            ctx.set_source_rgba(size / 1024, 0.5, 0.25, 0.75)
+            ctx.paint()
+            path = os.path.join(self.tmp, 'icon{0}.png'.format(size))
+            surface.write_to_png(path)
+            paths.append(path)
+        image_data = [
+            (size, size, size * 4, True, 8, 4, os.urandom(size * size * 4))
+            for size in (48, 128, 256)
+        ]
+
+        self.setup()
+        for i in range(self.count):
+            self.make_room()
+            if i % 3:
+                hints = {'image-path': paths[i % len(paths)]}
+            else:
+                hints = {'image-data': image_data[i % len(image_data)]}
+            yield self.notify(Notification(
+                'Icon {0}'.format(i % 10), 'Message body', hints=hints,
+                app_name='bench',
+            ))
+            # Let icons decoded in threads be drawn.
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+    def history(self):
+        history = [
+            Notification('History {0}'.format(i), 'Message body')
+            for i in range(self.count * 4)
+        ]
+        self.setup(history=history, history_size=self.count)
+        for _ in range(self.count):
+            yield self.measure(self.server.prev)
+        for _ in range(self.count):
+            yield self.measure(self.server.next)
+
+    workloads = ('burst', 'coalesce', 'replace', 'progress', 'icons', 'history')
+
+    def run(self, name):
+        samples = list(getattr(self, name)())
+        self.teardown()
+        return samples
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name, samples):
+    times = sorted(t * 1000 for t, _ in samples)
+    requests = sum(r for _, r in samples) / len(samples)
+    print('{0:<10} {1:>6} {2:>9.3f} {3:>9.3f} {4:>9.3f} {5:>10.1f}'.format(
+        name, len(samples), percentile(times, 0.5), percentile(times, 0.99),
+        times[-1], requests,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark qtools.notification.')
+    parser.add_argument('workloads', nargs='*', help='Workloads to run.')
+    parser.add_argument('--count', type=int, default=500, help='Notifications.')
+    parser.add_argument('--xvfb', action='store_true', help='Start Xvfb.')
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in Bench.workloads:
+            parser.error('unknown workload: {0}'.format(name))
+
+    xvfb = None
+    if args.xvfb or not os.environ.get('DISPLAY'):
+        xvfb, os.environ['DISPLAY'] = start_xvfb()
+
+    try:
+        # Keep the icon cache and history out of the user's cache directory.
+        os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp(prefix='qtools-bench-')
+        import libqtile
+        from libqtile.backend.x11 import xcbq
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        conn = xcbq.Connection(os.environ['DISPLAY'])
+        libqtile.init(LocalQtile(conn, loop))
+
+        from qtools.notification import notification
+        bench = Bench(conn, loop, notification, args.count)
+
+        print('{0:<10} {1:>6} {2:>9} {3:>9} {4:>9} {5:>10}'.format(
+            'workload', 'n', 'p50 ms', 'p99 ms', 'max ms', 'X req/n',
+        ))
+        for name in args.workloads or Bench.workloads:
+            report(name, bench.run(name))
+        conn.disconnect()
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+if __name__ == '__main__':
+    main()
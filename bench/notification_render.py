@@ -0,0 +1,105 @@
+"""
+Rendering throughput benchmark for qtools.notification.
+
+This renders a mix of notifications with OffscreenRenderer, which draws them exactly
+as the notification server would but into memory, so it needs neither Qtile nor an X
+display. It reports how many notifications are rendered per second along with p50
+and p99 render times, for each overflow option and with the render cache both on and
+off.
+
+Usage:
+
+    python bench/notification_render.py [--count N] [--png-dir DIR]
+
+With --png-dir, every rendered notification is also saved there as a PNG.
+
+"""
+
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cairocffi
+from libqtile.notify import Notification
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_notifications(count, directory):
+    """
+    Make count notifications with text of varying lengths, some with icons.
+    """
+    paths = []
+    for size in (48, 256):
+        surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, size, size)
+        ctx = cairocffi.Context(surface)
+        ctx.set_source_rgba(0.25, 0.5, 0.75, 0.75)
+        ctx.paint()
+        path = os.path.join(directory, 'icon{0}.png'.format(size))
+        surface.write_to_png(path)
+        paths.append(path)
+    image_data = (64, 64, 256, True, 8, 4, os.urandom(64 * 64 * 4))
+
+    words = 'the quick brown fox jumps over the lazy dog & <friends>'.split()
+    notifications = []
+    for i in range(count):
+        body = ' '.join(words[j % len(words)] for j in range(i % 40))
+        hints = {}
+        if i % 4 == 1:
+            hints['image-path'] = paths[i % 2]
+        elif i % 4 == 2:
+            hints['image-data'] = image_data
+        if i % 5 == 0:
+            hints['value'] = i % 101
+        notifications.append(Notification(
+            'Notification {0}'.format(i % 50), body, hints=hints, app_name='bench',
+        ))
+    return notifications
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark notification rendering.')
+    parser.add_argument('--count', type=int, default=2000, help='Notifications.')
+    parser.add_argument('--png-dir', help='Directory to save PNGs to.')
+    args = parser.parse_args()
+
+    from qtools.notification import OffscreenRenderer
+
+    tmp = tempfile.mkdtemp(prefix='qtools-bench-')
+    notifications = make_notifications(args.count, tmp)
+    if args.png_dir:
+        os.makedirs(args.png_dir, exist_ok=True)
+
+    print('{0:<12} {1:>6} {2:>9} {3:>9} {4:>9}'.format(
+        'overflow', 'cache', 'per sec', 'p50 ms', 'p99 ms',
+    ))
+    for overflow in ('truncate', 'more_width', 'more_height'):
+        for cache_size in (0, 4194304):
+            renderer = OffscreenRenderer(
+                overflow=overflow, render_cache_size=cache_size,
+            )
+            times = []
+            start = time.perf_counter()
+            for i, notif in enumerate(notifications):
+                path = None
+                if args.png_dir:
+                    path = os.path.join(args.png_dir, '{0}-{1}-{2}.png'.format(
+                        overflow, cache_size, i
+                    ))
+                before = time.perf_counter()
+                renderer.render(notif, path)
+                times.append(time.perf_counter() - before)
+            elapsed = time.perf_counter() - start
+            times.sort()
+            print('{0:<12} {1:>6} {2:>9.0f} {3:>9.3f} {4:>9.3f}'.format(
+                overflow, 'on' if cache_size else 'off', len(times) / elapsed,
+                times[len(times) // 2] * 1000, times[len(times) * 99 // 100] * 1000,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,99 @@
 """
 Simple base classes that can be used for multiple plugins.
+
+Plugins are imported when they are first accessed, e.g. qtools.notification, and
+libnotify and GStreamer are only loaded when a notification is first shown or a
+sound first played, so importing qtools for plugins that don't use them stays cheap.
 """
 
 
+import importlib
 import os
+import sys
 from random import randint
 
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
-gi.require_version('Notify', '0.7')
-from gi.repository import Notify
-
-from xcffib.xproto import StackMode
-from libqtile.drawer import Drawer
+from libqtile import configurable, hook, qtile
 from libqtile.lazy import lazy
-from libqtile.log_utils import logger
-from libqtile import configurable, pangocffi, window
+
+from .sound import play_sound, preload_sound
+
+
+_PLUGINS = (
+    'borders', 'focus', 'mpc', 'notification', 'rofi_searx', 'widget', 'xresources'
+)
+
+
+def __getattr__(name):
+    if name in _PLUGINS:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+_Notify = None
+
+
+def _get_notify():
+    """
+    Import and initialise libnotify the first time it is needed.
+    """
+    global _Notify
+    if _Notify is None:
+        import gi
+        gi.require_version('Notify', '0.7')
+        from gi.repository import Notify
+        Notify.init('Qtile')
+        _Notify = Notify
+    return _Notify
+
+
+def _direct_server():
+    """
+    Get the qtools.notification.Server running within Qtile, or None if there isn't
+    one. Only a server that is registered with libqtile.notify.notifier counts.
+    """
+    module = sys.modules.get('qtools.notification.notification')
+    if module is None:
+        return None
+    from libqtile import notify
+    for callback in notify.notifier.callbacks:
+        server = getattr(callback, '__self__', None)
+        if isinstance(server, module.Server):
+            return server
+    return None
 
 
 class Notifier(configurable.Configurable):
     """
     This is a base class for classes with methods that are to be executed upon key
     presses and that generate pop-up notifications.
-    """
-    _is_initted = False
 
+    If debounce is set, a notification is shown straight away but any more shown
+    within debounce milliseconds are merged into a single update showing the latest
+    body, which is sent at the end of that window. The sound is only played for the
+    first. This keeps a held key from sending a flood of notifications.
+    """
     defaults = [
         ('summary', 'Notifier', 'Notification summary.'),
         ('timeout', -1, 'Timeout for notifications.'),
         ('sound', None, 'Sound to make when sending notification'),
+        ('direct', True, 'Whether to skip D-Bus if Qtile is the notification server.'),
+        ('debounce', 0, 'Milliseconds within which to merge notifications, or 0.'),
     ]
 
     def __init__(self, **config):
-        if not Notifier._is_initted:
-            Notifier._is_initted = True
-            Notify.init('Qtile')
-
         configurable.Configurable.__init__(self, **config)
         self.add_defaults(Notifier.defaults)
-        self.notifier = Notify.Notification.new(
-            config.get('summary', 'Notifier'), ''
-        )
+        self._notification = None
+        self._debounce_timer = None
+        self._pending = None
         self.timeout = config.get('timeout', -1)
-        self.id = randint(10, 1000)
+        # Notification servers hand out IDs counting up from 1, so this is kept well
+        # above those while fitting in libnotify's signed 32 bit id property.
+        self.id = randint(2 ** 30, 2 ** 31 - 1)
 
         if self.sound is not None:
             self.sound = os.path.expanduser(self.sound)
+            hook.subscribe.startup_complete(self._preload_sound)
 
     def __getattr__(self, name):
         """
@@ -57,43 +104,90 @@ class Notifier(configurable.Configurable):
             return lazy.function(getattr(self, name[5:]))
         return configurable.Configurable.__getattr__(self, name)
 
+    def _preload_sound(self):
+        preload_sound(self.sound)
+
+    @property
+    def notifier(self):
+        """
+        The libnotify notification, which is created when it is first used.
+        """
+        if self._notification is None:
+            self._notification = _get_notify().Notification.new(self.summary, '')
+            self._notification.set_timeout(self._timeout)
+        return self._notification
+
     @property
     def timeout(self):
         return self._timeout
 
     @timeout.setter
     def timeout(self, value):
-        self.notifier.set_timeout(value)
+        if self._notification is not None:
+            self._notification.set_timeout(value)
         self._timeout = value
 
     def show(self, body):
         if not isinstance(body, str):
             body = str(body)
-        self.notifier.update(self.summary, body)
-        if hasattr(self, 'id'):
-            self.notifier.set_property('id', self.id)
-        self.notifier.show()
+        if self.debounce:
+            if self._debounce_timer is not None:
+                self._pending = body
+                return
+            self._debounce_timer = qtile.call_later(
+                self.debounce / 1000, self._flush_pending
+            )
+        self._update(body)
         if self.sound is not None:
             play_sound(self.sound)
 
-    def hide(self):
-        self.notifier.hide()
+    def _flush_pending(self):
+        """
+        Send the latest notification merged during the debounce window, if any. This
+        starts a new window so that a steady stream of calls is sent at most once per
+        window.
+        """
+        body = self._pending
+        self._pending = None
+        if body is None:
+            self._debounce_timer = None
+            return
+        self._debounce_timer = qtile.call_later(
+            self.debounce / 1000, self._flush_pending
+        )
+        self._update(body)
 
+    def _update(self, body):
+        if not (self.direct and self._show_direct(body)):
+            self.notifier.update(self.summary, body)
+            if hasattr(self, 'id'):
+                self.notifier.set_property('id', self.id)
+            self.notifier.show()
 
-Gst.init(None)
+    def _show_direct(self, body):
+        """
+        If qtools.notification.Server is running within Qtile, hand it the notification
+        directly rather than sending it out over D-Bus and back in again. It replaces
+        earlier notifications from this Notifier in the same way. Returns False if there
+        is no such server.
+        """
+        if _direct_server() is None:
+            return False
+        from libqtile import notify
+        replaces_id = getattr(self, 'id', None)
+        notify.notifier.add(notify.Notification(
+            self.summary, body, self.timeout, {}, 'Qtile', replaces_id, '',
+        ))
+        return True
 
-def play_sound(path):
-    """
-    Play an audio file. This accepts a full path to an audio file. This is mostly a
-    snippet from the playsound library.
-    """
-    playbin = Gst.ElementFactory.make('playbin', 'playbin')
-    playbin.props.uri = 'file://' + path
-
-    set_result = playbin.set_state(Gst.State.PLAYING)
-    if set_result == Gst.StateChangeReturn.ASYNC:
-        bus = playbin.get_bus()
-        bus.poll(Gst.MessageType.EOS, Gst.CLOCK_TIME_NONE)
-        playbin.set_state(Gst.State.NULL)
-    else:
-        logger.exception("qtools.play_sound failed with file: {0}".format(path))
+    def hide(self):
+        if self._debounce_timer is not None:
+            self._debounce_timer.cancel()
+            self._debounce_timer = None
+        self._pending = None
+        if self.direct:
+            server = _direct_server()
+            if server is not None:
+                server.dismiss(getattr(self, 'id', None))
+        if self._notification is not None:
+            self._notification.hide()
@@ -1,2 +1,3 @@
+from .library import Library
 from .mpc import Client
-__all__ = ('Client',)
+__all__ = ('Client', 'Library')
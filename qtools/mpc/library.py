@@ -0,0 +1,341 @@
+"""
+Qtile plugin to browse the library of Music Player Daemon with rofi and play from it
+
+Example usage:
+
+    import qtools.mpc
+    library = qtools.mpc.Library()
+    keys.extend([EzKey(k, v) for k, v in {
+        'M-m':   library.lazy_artists,
+        'M-S-m': library.lazy_albums,
+        'M-C-m': library.lazy_tracks,
+    }.items()])
+
+"""
+
+
+import asyncio
+import json
+import os
+from functools import wraps
+
+from libqtile import hook, qtile
+from libqtile.log_utils import logger
+from libqtile.utils import get_cache_dir
+
+from qtools import Notifier
+from .protocol import Connection, MPDError, to_dict
+
+
+_INDEX = os.path.join(get_cache_dir(), 'mpd_library.json')
+
+# The tags kept for each track, in the order that they are stored in the index.
+TAGS = ('Artist', 'AlbumArtist', 'Album', 'Title', 'Track', 'Disc')
+
+# The most files to look up in one command list when bringing the index up to date.
+CHUNK_SIZE = 1000
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+
+def _songs(pairs):
+    """
+    Split a response listing songs into a dict for each song. Directories and playlists
+    in the response are skipped.
+    """
+    song = None
+    for key, value in pairs:
+        if key == 'file':
+            if song is not None:
+                yield song
+            song = {'file': value}
+        elif key in ('directory', 'playlist'):
+            if song is not None:
+                yield song
+            song = None
+        elif song is not None:
+            song.setdefault(key, value)
+    if song is not None:
+        yield song
+
+
+def _number(value):
+    """
+    The number at the start of a track or disc tag such as "3/12", or 0.
+    """
+    digits = ''
+    for char in value:
+        if not char.isdigit():
+            break
+        digits += char
+    return int(digits) if digits else 0
+
+
+def _load(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("qtools.mpc: could not read library index: {0}".format(e))
+        return None
+
+
+def _save(path, data):
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+def _background(func):
+    @wraps(func)
+    def _inner(self, qtile=None):
+        asyncio.ensure_future(func(self))
+    return _inner
+
+
+class Library(Notifier):
+    """
+    Pick an artist, album or track from MPD's library with rofi and play it.
+
+    The tags of every track are kept in an index in memory, so rofi opens straight away
+    however large the library is. The index is saved to index_file and loaded when
+    Qtile starts. A connection to MPD idles on its database, and when MPD reports that
+    the database has changed, only what differs is fetched: tracks modified since the
+    index was last updated and tracks whose paths are new, which are found by comparing
+    the list of paths in the library with those in the index. The whole library is
+    only fetched when there is no index yet.
+
+    Picking an album plays the whole album, or it can be played from one of its
+    tracks. Tracks are added to the end of the queue, or replace it if replace is True.
+    """
+    defaults = [
+        ('summary', 'Music', 'Notification summary.'),
+        ('host', '127.0.0.1', 'IP address of MPD server.'),
+        ('port', '6600', 'Port of MPD server.'),
+        ('socket', None, "Path to MPD's Unix socket, used instead of host and port."),
+        ('mpd_timeout', 5, 'Seconds to wait for MPD to respond.'),
+        ('max_backoff', 60, 'Maximum seconds to wait between reconnection attempts.'),
+        ('index_file', _INDEX, 'File in which to save the library index.'),
+        ('replace', False, 'Whether to clear the queue before adding tracks.'),
+        ('theme', None, 'rofi theme to use.'),
+    ]
+
+    def __init__(self, **config):
+        Notifier.__init__(self, **config)
+        self.add_defaults(Library.defaults)
+
+        self.command = ['rofi', '-dmenu', '-i', '-no-custom', '-format', 'i']
+        if self.theme:
+            self.command.extend(['-theme', self.theme])
+
+        self.index = None
+        self.db_update = None
+        self._albums = None
+        self._artists = None
+        self._task = None
+        hook.subscribe.startup_complete(self.start)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch())
+
+    async def _watch(self):
+        data = await qtile.run_in_executor(_load, self.index_file)
+        if data:
+            self.db_update = data['db_update']
+            self._set_index(data['tracks'])
+
+        connection = Connection(self.host, self.port, self.socket, self.mpd_timeout)
+        backoff = 1
+        while True:
+            try:
+                await connection.connect()
+                backoff = 1
+                while True:
+                    await self._sync_index(connection)
+                    await connection.idle('database')
+            except (ConnectionError, OSError, asyncio.TimeoutError, MPDError) as e:
+                logger.warning("qtools.mpc: not watching MPD's library: {0}".format(e))
+                connection.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _sync_index(self, connection):
+        """
+        Bring the index up to date with MPD's database, if it has changed.
+        """
+        stats, = await connection.execute(('stats',))
+        db_update = to_dict(stats).get('db_update')
+        if db_update == self.db_update and self.index is not None:
+            return
+
+        if self.index is None or self.db_update is None:
+            response, = await connection.execute(('listallinfo',))
+            tracks = {song['file']: self._entry(song) for song in _songs(response)}
+        else:
+            modified, paths = await connection.execute(
+                ('find', "(modified-since '{0}')".format(_escape(self.db_update))),
+                ('listall',),
+            )
+            tracks = dict(self.index)
+            for song in _songs(modified):
+                tracks[song['file']] = self._entry(song)
+            present = {value for key, value in paths if key == 'file'}
+            for path in tracks.keys() - present:
+                del tracks[path]
+            added = list(present - tracks.keys())
+            for i in range(0, len(added), CHUNK_SIZE):
+                responses = await connection.execute(*[
+                    ('find', "(file == '{0}')".format(_escape(path)))
+                    for path in added[i:i + CHUNK_SIZE]
+                ])
+                for response in responses:
+                    for song in _songs(response):
+                        tracks[song['file']] = self._entry(song)
+
+        self.db_update = db_update
+        self._set_index(tracks)
+        data = {'db_update': db_update, 'tracks': tracks}
+        try:
+            await qtile.run_in_executor(_save, self.index_file, data)
+        except OSError as e:
+            logger.warning("qtools.mpc: could not save library index: {0}".format(e))
+
+    @staticmethod
+    def _entry(song):
+        return [song.get(tag, '') for tag in TAGS]
+
+    def _set_index(self, tracks):
+        """
+        Replace the index, and group its tracks into albums and artists ready for
+        browsing.
+        """
+        albums = {}
+        artists = {}
+        for path, (artist, album_artist, album, _, _, _) in tracks.items():
+            key = (album_artist or artist, album)
+            albums.setdefault(key, []).append(path)
+            artists.setdefault(artist, set()).add(key)
+
+        def order(path):
+            _, _, _, title, track, disc = tracks[path]
+            return (_number(disc), _number(track), title, path)
+
+        for paths in albums.values():
+            paths.sort(key=order)
+
+        self.index = tracks
+        self._albums = albums
+        self._artists = artists
+
+    async def _choose(self, prompt, entries):
+        """
+        Let the user pick one of entries with rofi, returning its index or None.
+        """
+        process = await asyncio.create_subprocess_exec(
+            *self.command, '-p', prompt,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+        )
+        lines = '\n'.join(entry.replace('\n', ' ') for entry in entries)
+        stdout, _ = await process.communicate(lines.encode())
+        if process.returncode or not stdout.strip():
+            return None
+        # rofi gives -1 when text that matches nothing is entered.
+        choice = int(stdout)
+        return choice if 0 <= choice < len(entries) else None
+
+    def _album_name(self, key):
+        artist, album = key
+        return '{0} - {1}'.format(album or 'Unknown album', artist or 'Unknown artist')
+
+    def _track_name(self, path):
+        artist, _, _, title, _, _ = self.index[path]
+        return '{0} - {1}'.format(
+            artist or 'Unknown artist', title or os.path.basename(path)
+        )
+
+    def _ready(self):
+        if self.index is None:
+            self.show('The library has not been indexed yet')
+            return False
+        return True
+
+    @_background
+    async def artists(self):
+        if not self._ready():
+            return
+        names = sorted(self._artists, key=str.casefold)
+        choice = await self._choose(
+            'Artist', [name or 'Unknown artist' for name in names]
+        )
+        if choice is None:
+            return
+        keys = sorted(self._artists[names[choice]], key=lambda k: k[1].casefold())
+        if len(keys) == 1:
+            await self._pick_track(keys[0])
+            return
+        choice = await self._choose('Album', [self._album_name(key) for key in keys])
+        if choice is not None:
+            await self._pick_track(keys[choice])
+
+    @_background
+    async def albums(self):
+        if not self._ready():
+            return
+        keys = sorted(self._albums, key=lambda k: (k[1].casefold(), k[0].casefold()))
+        choice = await self._choose('Album', [self._album_name(key) for key in keys])
+        if choice is not None:
+            await self._pick_track(keys[choice])
+
+    @_background
+    async def tracks(self):
+        if not self._ready():
+            return
+        paths = sorted(self.index, key=lambda p: self._track_name(p).casefold())
+        choice = await self._choose('Track', [self._track_name(p) for p in paths])
+        if choice is not None:
+            await self._play(paths[choice:choice + 1])
+
+    async def _pick_track(self, key):
+        """
+        Pick a track of an album to play the album from, or the whole album.
+        """
+        paths = self._albums.get(key)
+        if not paths:
+            return
+        entries = ['Whole album'] + [self._track_name(path) for path in paths]
+        choice = await self._choose(self._album_name(key), entries)
+        if choice is not None:
+            await self._play(paths, max(choice - 1, 0))
+
+    async def _play(self, paths, start=0):
+        """
+        Add tracks to the queue and play them, starting from the one at index start.
+        """
+        if not paths:
+            return
+        commands = [('addid', path) for path in paths]
+        if self.replace:
+            commands.insert(0, ('clear',))
+        # Tracks are picked rarely enough that a connection isn't kept open for this.
+        connection = Connection(self.host, self.port, self.socket, self.mpd_timeout)
+        try:
+            await connection.connect()
+            responses = await connection.execute(*commands)
+            song_id = to_dict(responses[start - len(paths)]).get('Id')
+            await connection.execute(('playid', song_id))
+        except MPDError as e:
+            logger.warning("qtools.mpc: {0}".format(e))
+            return
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            logger.warning("qtools.mpc: could not connect to MPD: {0}".format(e))
+            self.show('Not connected')
+            return
+        finally:
+            connection.close()
+        self.show(self._track_name(paths[start]))
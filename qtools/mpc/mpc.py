@@ -1,5 +1,5 @@
 """
-Qtile plugin to control Music Player Daemon using musicpd or mpd2 library
+Qtile plugin to control Music Player Daemon without blocking Qtile
 
 Example usage:
 
@@ -13,15 +13,17 @@ Example usage:
     }.items()])
 
 """
-# pylint: disable=no-member,redefined-builtin
 
+
+import asyncio
 from functools import wraps
 
-try:
-    from musicpd import ConnectionError, MPDClient
-except ImportError:
-    from mpd import ConnectionError, MPDClient
+from libqtile import hook, qtile
+from libqtile.log_utils import logger
+
 from qtools import Notifier
+from .protocol import Connection, MPDError
+from .state import get_state
 
 
 bodies = {
@@ -31,22 +33,40 @@ bodies = {
 }
 
 
+def _song_body(song):
+    return '{0} - {1}'.format(song.get('Artist', ''), song.get('Title', ''))
+
+
 def _client_func(func):
+    """
+    Turn a coroutine that talks to MPD and returns a notification body into a command
+    that runs it in the background and shows the notification once it is done.
+    """
     @wraps(func)
     def _inner(self, qtile=None):
-        try:
-            self.client.connect()
-        except ConnectionError:
-            pass
-        self.show(func(self))
-        self.client.disconnect()
+        asyncio.ensure_future(self._run(func))
     return _inner
 
 
 class Client(Notifier):
     """
     The host and port are 127.0.0.1 and 6600 by default but can be set by passing these
-    when initiating the client.
+    when initiating the client. Alternatively, socket can be set to the path of MPD's
+    Unix socket.
+
+    MPD is talked to asynchronously on Qtile's event loop, so a slow or unreachable MPD
+    never holds up Qtile. The commands of each action are sent together as a command
+    list, and the notification is shown when the reply arrives.
+
+    MPD's state and current song are also kept in memory by a second connection that
+    idles on MPD, and this is shared with qtools.widget.NowPlaying. This lets toggle
+    decide what to do without asking MPD first, and responses to each action are fed
+    back into it.
+
+    The connection to MPD is opened on first use and kept open, with a ping sent after
+    keepalive seconds of inactivity so that MPD doesn't close it, which it does after
+    60 seconds by default. If the connection is lost, reconnection is attempted in the
+    background, waiting twice as long after each failure up to max_backoff seconds.
 
     The notification timeout can be changed by setting Client.timeout to milliseconds
     (int) or -1, which then uses the notification server's default timeout.
@@ -55,37 +75,143 @@ class Client(Notifier):
         ('summary', 'Music', 'Notification summary.'),
         ('host', '127.0.0.1', 'IP address of MPD server.'),
         ('port', '6600', 'Port of MPD server.'),
+        ('socket', None, "Path to MPD's Unix socket, used instead of host and port."),
+        ('keepalive', 50, 'Seconds of inactivity after which to ping MPD, or None.'),
+        ('max_backoff', 60, 'Maximum seconds to wait between reconnection attempts.'),
+        ('mpd_timeout', 5, 'Seconds to wait for MPD to respond.'),
     ]
 
     def __init__(self, **config):
         Notifier.__init__(self, **config)
         self.add_defaults(Client.defaults)
 
-        self.client = MPDClient()
-        self.client.host = self.host
-        self.client.port = self.port
+        self.client = Connection(self.host, self.port, self.socket, self.mpd_timeout)
+        self._connecting = None
+        self._backoff = 1
+        self._ping_timer = None
+        self._reconnect_timer = None
+
+        self.state = get_state(
+            self.host, self.port, self.socket, self.mpd_timeout, self.max_backoff
+        )
+        hook.subscribe.startup_complete(self.state.start)
+
+    async def _run(self, func):
+        self.state.start()
+        for _ in range(2):
+            if not self.client.connected and not await self._connect():
+                self.show('Not connected')
+                return
+            try:
+                body = await func(self)
+            except MPDError as e:
+                logger.warning("qtools.mpc: {0}".format(e))
+                return
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                # The connection may have dropped since it was last used, so reconnect
+                # and try once more.
+                self._lost(e)
+                continue
+            self._keepalive()
+            self.show(body)
+            return
+        self._schedule_reconnect()
+
+    async def _connect(self):
+        """
+        Connect to MPD, returning whether this succeeded. Concurrent calls share one
+        connection attempt.
+        """
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._open())
+        connecting = self._connecting
+        try:
+            return await asyncio.shield(connecting)
+        finally:
+            if connecting.done() and self._connecting is connecting:
+                self._connecting = None
+
+    async def _open(self):
+        if self._reconnect_timer is not None:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+        try:
+            await self.client.connect()
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            logger.warning("qtools.mpc: could not connect to MPD: {0}".format(e))
+            self._schedule_reconnect()
+            return False
+        self._backoff = 1
+        self._keepalive()
+        return True
+
+    def _lost(self, error):
+        logger.warning("qtools.mpc: lost connection to MPD: {0}".format(error))
+        if self._ping_timer is not None:
+            self._ping_timer.cancel()
+            self._ping_timer = None
+        self.client.close()
+
+    def _schedule_reconnect(self):
+        if self._reconnect_timer is None:
+            self._reconnect_timer = qtile.call_later(self._backoff, self._reconnect)
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def _reconnect(self):
+        self._reconnect_timer = None
+        if not self.client.connected:
+            asyncio.ensure_future(self._connect())
+
+    def _keepalive(self):
+        """
+        Schedule a ping for keepalive seconds from now, replacing any that was
+        scheduled, as MPD's timeout restarts whenever a command is sent.
+        """
+        if self._ping_timer is not None:
+            self._ping_timer.cancel()
+            self._ping_timer = None
+        if self.keepalive:
+            self._ping_timer = qtile.call_later(self.keepalive, self._start_ping)
+
+    def _start_ping(self):
+        self._ping_timer = None
+        asyncio.ensure_future(self._ping())
+
+    async def _ping(self):
+        try:
+            await self.client.execute(('ping',))
+        except (ConnectionError, OSError, asyncio.TimeoutError, MPDError) as e:
+            self._lost(e)
+            self._schedule_reconnect()
+            return
+        self._keepalive()
 
     @_client_func
-    def toggle(self):
-        if self.client.status()['state'] == 'play':
-            self.client.pause()
+    async def toggle(self):
+        if not self.state.synced:
+            status, = await self.client.execute(('status',))
+            self.state.update(status=status)
+        if self.state.status.get('state') == 'play':
+            command = ('pause', 1)
         else:
-            self.client.play()
-        return bodies.get(self.client.status()['state'])
+            command = ('play',)
+        _, status = await self.client.execute(command, ('status',))
+        self.state.update(status=status)
+        return bodies.get(self.state.status.get('state'))
 
     @_client_func
-    def next(self):
-        self.client.next()
-        current = self.client.currentsong()
-        return f"{current['artist']} - {current['title']}"
+    async def next(self):
+        _, song = await self.client.execute(('next',), ('currentsong',))
+        self.state.update(song=song)
+        return _song_body(self.state.song)
 
     @_client_func
-    def previous(self):
-        self.client.previous()
-        current = self.client.currentsong()
-        return f"{current['artist']} - {current['title']}"
+    async def previous(self):
+        _, song = await self.client.execute(('previous',), ('currentsong',))
+        self.state.update(song=song)
+        return _song_body(self.state.song)
 
     @_client_func
-    def stop(self):
-        self.client.stop()
+    async def stop(self):
+        await self.client.execute(('stop',))
         return 'Stopped'
@@ -0,0 +1,146 @@
+"""
+A minimal client for the MPD protocol that runs on asyncio.
+"""
+
+
+import asyncio
+
+
+class MPDError(Exception):
+    """
+    An error response (ACK) from MPD.
+    """
+
+
+def _quote(arg):
+    return '"' + str(arg).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _format(command):
+    name, *args = command
+    return ' '.join([name] + [_quote(arg) for arg in args]) + '\n'
+
+
+def to_dict(pairs):
+    """
+    Turn the key/value pairs of a response into a dict, keeping the first value for
+    keys that appear more than once.
+    """
+    result = {}
+    for key, value in pairs:
+        result.setdefault(key, value)
+    return result
+
+
+class Connection:
+    """
+    One connection to MPD, either over TCP to host and port or to a Unix socket. This
+    never blocks the event loop, and any step that takes longer than timeout seconds
+    fails with asyncio.TimeoutError.
+
+    Commands are tuples of the command name followed by its arguments, e.g.
+    ('pause', 1). execute sends any number of commands in a single command list and
+    returns the response of each as a list of (key, value) pairs, so a whole action
+    costs one round trip. Commands are sent one batch at a time.
+
+    idle waits for MPD to report changes, for as long as that takes.
+    """
+    def __init__(self, host='127.0.0.1', port=6600, socket=None, timeout=5):
+        self.host = host
+        self.port = port
+        self.socket = socket
+        self.timeout = timeout
+        self.version = None
+        self._reader = None
+        self._writer = None
+        self._lock = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def connect(self):
+        if self.socket:
+            opening = asyncio.open_unix_connection(self.socket)
+        else:
+            opening = asyncio.open_connection(self.host, int(self.port))
+        self._reader, self._writer = await asyncio.wait_for(opening, self.timeout)
+        try:
+            greeting = await self._readline(self.timeout)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.close()
+            raise
+        if not greeting.startswith('OK MPD '):
+            self.close()
+            raise ConnectionError('Unexpected greeting from MPD: ' + greeting)
+        self.version = greeting[7:]
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _readline(self, timeout):
+        line = await asyncio.wait_for(self._reader.readline(), timeout)
+        if not line.endswith(b'\n'):
+            raise ConnectionError('Connection closed by MPD')
+        return line[:-1].decode('utf-8', 'replace')
+
+    async def execute(self, *commands):
+        """
+        Run commands in one command list, returning a list of their responses. If MPD
+        replies with an error, MPDError is raised and the commands after the failing
+        one are not run. If the connection fails, it is closed.
+        """
+        return await self._locked(commands, self.timeout)
+
+    async def idle(self, *subsystems):
+        """
+        Wait until any of subsystems changes, or any at all if none are given, and
+        return the names of those that changed. The timeout doesn't apply to the wait.
+        """
+        response, = await self._locked([('idle',) + subsystems], None)
+        return [value for key, value in response if key == 'changed']
+
+    async def _locked(self, commands, timeout):
+        if self._lock is None:
+            # Created here so that it belongs to the running event loop.
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.connected:
+                raise ConnectionError('Not connected to MPD')
+            try:
+                return await self._execute(commands, timeout)
+            except (ConnectionError, OSError, asyncio.TimeoutError,
+                    asyncio.CancelledError):
+                # The rest of the response would be read as the reply to the next
+                # commands, so the connection can't be used any more.
+                self.close()
+                raise
+
+    async def _execute(self, commands, timeout):
+        if len(commands) == 1:
+            data = _format(commands[0])
+        else:
+            data = 'command_list_ok_begin\n{0}command_list_end\n'.format(
+                ''.join(_format(command) for command in commands)
+            )
+        self._writer.write(data.encode('utf-8'))
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+
+        results = []
+        current = []
+        while True:
+            line = await self._readline(timeout)
+            if line == 'OK':
+                if len(commands) == 1:
+                    results.append(current)
+                return results
+            if line == 'list_OK':
+                results.append(current)
+                current = []
+            elif line.startswith('ACK '):
+                raise MPDError(line[4:])
+            else:
+                key, _, value = line.partition(': ')
+                current.append((key, value))
@@ -0,0 +1,88 @@
+"""
+An in-memory snapshot of MPD's state, kept up to date by idling on MPD.
+"""
+
+
+import asyncio
+
+from libqtile import qtile
+from libqtile.log_utils import logger
+
+from .protocol import Connection, MPDError, to_dict
+
+
+# The subsystems that affect the snapshot.
+SUBSYSTEMS = ('player', 'playlist', 'mixer')
+
+_states = {}
+
+
+def get_state(host, port, socket, timeout, max_backoff):
+    """
+    Get the State for an MPD server, creating it the first time, so that everything
+    talking to the same server shares one snapshot and one idle connection.
+    """
+    key = socket or (host, str(port))
+    if key not in _states:
+        _states[key] = State(host, port, socket, timeout, max_backoff)
+    return _states[key]
+
+
+class State:
+    """
+    The output of MPD's status and currentsong commands, as dicts in status and song.
+
+    Once started, this keeps its own connection to MPD open in idle mode and fetches
+    both again whenever MPD reports a change to any of SUBSYSTEMS, so reading them never
+    costs a round trip. Responses received elsewhere can be put in with update.
+    Callbacks subscribed to the state are called after each change. If MPD can't be
+    reached, synced is False and the snapshot is empty until it can.
+    """
+    def __init__(self, host, port, socket, timeout, max_backoff):
+        self.connection = Connection(host, port, socket, timeout)
+        self.max_backoff = max_backoff
+        self.status = {}
+        self.song = {}
+        self.synced = False
+        self._callbacks = []
+        self._task = None
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch())
+
+    def update(self, status=None, song=None):
+        """
+        Replace the status and/or song with responses from MPD.
+        """
+        if status is not None:
+            self.status = to_dict(status)
+        if song is not None:
+            self.song = to_dict(song)
+        for callback in self._callbacks:
+            qtile.call_soon(callback)
+
+    async def _watch(self):
+        backoff = 1
+        while True:
+            try:
+                await self.connection.connect()
+                backoff = 1
+                while True:
+                    status, song = await self.connection.execute(
+                        ('status',), ('currentsong',)
+                    )
+                    self.synced = True
+                    self.update(status, song)
+                    await self.connection.idle(*SUBSYSTEMS)
+            except (ConnectionError, OSError, asyncio.TimeoutError, MPDError) as e:
+                logger.warning("qtools.mpc: not watching MPD: {0}".format(e))
+                self.connection.close()
+            if self.synced:
+                self.synced = False
+                self.update([], [])
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
@@ -1,2 +1,3 @@
 from .notification import Server
-__all__ = ('Server',)
+from .offscreen import OffscreenPopup, OffscreenRenderer
+__all__ = ('Server', 'OffscreenPopup', 'OffscreenRenderer')
@@ -0,0 +1,203 @@
+"""
+Caches used by the notification server to avoid repeating expensive work.
+"""
+
+
+import hashlib
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+
+import cairocffi
+from libqtile import images
+from libqtile.log_utils import logger
+
+
+class LRUCache:
+    """
+    A least-recently-used mapping that is bounded by the total size in bytes of its
+    values rather than by the number of entries. The size of each value is given when it
+    is stored, and the oldest entries are evicted until the new value fits.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Get the value stored under key, marking it as most recently used.
+        """
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, nbytes):
+        """
+        Store value under key. Values larger than the whole cache are not stored.
+        """
+        self.pop(key)
+        if nbytes > self.max_bytes:
+            return
+        while self._entries and self.size + nbytes > self.max_bytes:
+            _, (_, old) = self._entries.popitem(last=False)
+            self.size -= old
+        self._entries[key] = value, nbytes
+        self.size += nbytes
+
+    def pop(self, key, default=None):
+        try:
+            value, nbytes = self._entries.pop(key)
+        except KeyError:
+            return default
+        self.size -= nbytes
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+        }
+
+
+def surface_size(surface):
+    """
+    Get the number of bytes of pixel data held by a cairo ImageSurface.
+    """
+    return surface.get_stride() * surface.get_height()
+
+
+def snapshot(drawer, width, height):
+    """
+    Copy what has been drawn with a Drawer so far into a new ImageSurface which can be
+    painted back onto a Drawer later on with a single operation.
+    """
+    surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, width, height)
+    ctx = cairocffi.Context(surface)
+    ctx.set_source_surface(drawer.surface, 0, 0)
+    ctx.paint()
+    surface.flush()
+    return surface
+
+
+def decode_icon(path, size):
+    """
+    Load an image file and decode it into an ImageSurface that fits within a square of
+    the given size. This does not touch any Qtile state so can be run in a thread.
+    """
+    img = images.Img.from_path(path)
+    if img.width > img.height:
+        img.resize(width=size)
+    else:
+        img.resize(height=size)
+    surface, _ = images._decode_to_image_surface(img.bytes_img, img.width, img.height)
+    return surface
+
+
+class IconDiskCache:
+    """
+    A cache of icons that have already been decoded and resized, stored in a directory
+    as raw ARGB32 pixel data following a small header. Files are named after a hash of
+    the icon path, its mtime and the icon size, so changed icons are never served stale.
+    Cached files are memory-mapped and the ImageSurfaces returned by load use the mapped
+    memory directly, without copying the pixels.
+    """
+    header = struct.Struct('=4sIII')
+    magic = b'QTIC'
+    max_age = 30 * 24 * 60 * 60
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._prune()
+
+    def _prune(self):
+        """
+        Remove files that have not been written in a while, which are mostly left over
+        from icons that have since been modified.
+        """
+        cutoff = time.time() - self.max_age
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+
+    def _file(self, path, mtime, size):
+        key = '{0}:{1}:{2}'.format(path, mtime, size).encode()
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + '.argb')
+
+    def load(self, path, mtime, size):
+        """
+        Get a cached icon as an ImageSurface backed by the mapped file, or None.
+        """
+        try:
+            with open(self._file(path, mtime, size), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return None
+
+        if len(mapped) < self.header.size:
+            mapped.close()
+            return None
+        magic, width, height, stride = self.header.unpack_from(mapped)
+        if magic != self.magic or len(mapped) != self.header.size + stride * height:
+            mapped.close()
+            return None
+
+        data = memoryview(mapped)[self.header.size:]
+        return cairocffi.ImageSurface.create_for_data(
+            data, cairocffi.FORMAT_ARGB32, width, height, stride
+        )
+
+    def store(self, path, mtime, size, surface):
+        """
+        Write an icon to the cache, returning it as an ARGB32 ImageSurface.
+        """
+        if surface.get_format() != cairocffi.FORMAT_ARGB32:
+            argb = cairocffi.ImageSurface(
+                cairocffi.FORMAT_ARGB32, surface.get_width(), surface.get_height()
+            )
+            ctx = cairocffi.Context(argb)
+            ctx.set_source_surface(surface, 0, 0)
+            ctx.paint()
+            surface = argb
+        surface.flush()
+
+        cached = self._file(path, mtime, size)
+        header = self.header.pack(
+            self.magic, surface.get_width(), surface.get_height(), surface.get_stride()
+        )
+        try:
+            with open(cached + '.tmp', 'wb') as f:
+                f.write(header)
+                f.write(surface.get_data())
+            os.replace(cached + '.tmp', cached)
+        except OSError as e:
+            logger.warning("qtools.notification: could not cache icon: {0}".format(e))
+        return surface
@@ -0,0 +1,129 @@
+"""
+A stream of notification events published on a Unix socket.
+"""
+
+
+import asyncio
+import fcntl
+import json
+import os
+import socket
+import stat
+from collections import deque
+
+from libqtile.log_utils import logger
+
+
+class _Subscriber:
+    """
+    A connected client along with the events waiting to be sent to it. At most size
+    events are held and the oldest are dropped to make room for new ones, so a client
+    that doesn't keep up can't make the server hold on to an unbounded backlog.
+    """
+    def __init__(self, writer, size):
+        self.writer = writer
+        self.events = deque(maxlen=size)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def push(self, line):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(line)
+        self._ready.set()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.events:
+                if self.dropped:
+                    self.writer.write(_encode('dropped', {'count': self.dropped}))
+                    self.dropped = 0
+                self.writer.write(self.events.popleft())
+                await self.writer.drain()
+
+
+async def _read_until_eof(reader):
+    while await reader.read(4096):
+        pass
+
+
+def _encode(event, fields):
+    return (json.dumps(dict(fields, event=event)) + '\n').encode()
+
+
+class EventStream:
+    """
+    Publishes events as newline-delimited JSON objects to every client connected to a
+    Unix socket. Each object has an 'event' key naming the event alongside its fields.
+    Clients are only written to when the event loop is free, and each has its own
+    buffer of buffer_size events, so publishing never blocks. When events had to be
+    dropped for a client, it is sent a 'dropped' event with their count before the
+    events that follow.
+    """
+    def __init__(self, path, buffer_size):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._subscribers = set()
+        self._server = None
+
+        # A socket left behind by an earlier run is replaced, but anything else at the
+        # path is left alone and binding then fails.
+        try:
+            if stat.S_ISSOCK(os.lstat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
+        flags = fcntl.fcntl(self._sock.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(self._sock.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        self._sock.bind(path)
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._connected, sock=self._sock)
+
+    async def _connected(self, reader, writer):
+        """
+        Send events to a new client until it disconnects. Anything that the client
+        sends is ignored.
+        """
+        subscriber = _Subscriber(writer, self.buffer_size)
+        self._subscribers.add(subscriber)
+        sender = asyncio.ensure_future(subscriber.run())
+        receiver = asyncio.ensure_future(_read_until_eof(reader))
+        try:
+            await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._subscribers.discard(subscriber)
+            for task in (sender, receiver):
+                if task.done():
+                    if not task.cancelled():
+                        task.exception()
+                else:
+                    task.cancel()
+            writer.close()
+
+    def publish(self, event, fields):
+        """
+        Queue an event to be sent to every client.
+        """
+        if not self._subscribers:
+            return
+        line = _encode(event, fields)
+        for subscriber in self._subscribers:
+            subscriber.push(line)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        else:
+            self._sock.close()
+        for subscriber in self._subscribers:
+            subscriber.writer.close()
+        self._subscribers.clear()
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            logger.warning("qtools.notification: {0}".format(e))
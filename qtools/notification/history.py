@@ -0,0 +1,248 @@
+"""
+Notification history with a bounded memory footprint that persists across restarts.
+"""
+
+
+import json
+import os
+import struct
+from array import array
+
+from libqtile.log_utils import logger
+from libqtile.notify import Notification
+
+
+# Hints that are saved to the log. Others, such as image-data, are too large or only
+# make sense while the sending app is running.
+_SAVED_HINTS = ('urgency', 'category', 'desktop-entry', 'image-path', 'value')
+
+
+class History:
+    """
+    A list-like store of notifications that can take the place of
+    libqtile.notify.notifier.notifications. Its length is the total number of
+    notifications ever added, so notification IDs stay unique, but only the latest size
+    notifications are held in memory in a ring buffer.
+
+    If a path is given, every notification is also appended to a log file as a
+    length-prefixed JSON record, and the byte offset of each record is appended to an
+    index file alongside it. Older notifications can then be read back one at a time
+    with a single seek, and the history survives restarts without the whole log being
+    loaded. Whenever the log holds more than twice max_records notifications it is cut
+    down to the latest max_records, so it stays bounded however long Qtile runs. Indices
+    don't change when this happens while running; older notifications just can't be
+    retrieved any more.
+    """
+    record = struct.Struct('<I')
+    offset = struct.Struct('<Q')
+
+    def __init__(self, size, path=None, max_records=10000):
+        self.size = size
+        self.max_records = max_records
+        self._ring = [None] * size
+        self._count = 0
+        self._base = 0
+        self._path = path
+        self._offsets = array('Q')
+        self._log = None
+        self._log_size = 0
+        self._index = None
+        self._reader = None
+
+        if path is not None:
+            try:
+                self._open(path, max_records)
+            except OSError as e:
+                logger.exception(e)
+                self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('history index out of range')
+        if index >= self._count - self.size:
+            return self._ring[index % self.size]
+        if self._reader is None or index < self._base:
+            raise IndexError('notification is no longer in the history')
+        self._reader.seek(self._offsets[index - self._base])
+        return self._read_record(self._reader)
+
+    @property
+    def first(self):
+        """
+        The index of the oldest notification that can still be retrieved.
+        """
+        first = max(0, self._count - self.size)
+        if self._reader is not None:
+            return min(self._base, first)
+        return first
+
+    def append(self, notif):
+        self._ring[self._count % self.size] = notif
+        self._count += 1
+        if self._log is None:
+            return
+
+        payload = json.dumps(self._encode(notif)).encode()
+        try:
+            self._log.write(self.record.pack(len(payload)) + payload)
+            self._log.flush()
+            # The index isn't flushed each time, as one that is behind the log is
+            # rebuilt on startup.
+            self._index.write(self.offset.pack(self._log_size))
+        except OSError as e:
+            logger.exception(e)
+            self.close()
+            return
+        self._offsets.append(self._log_size)
+        self._log_size += self.record.size + len(payload)
+        if len(self._offsets) > 2 * self.max_records:
+            self._rotate()
+
+    def close(self):
+        """
+        Stop writing to the log. Notifications that are only on disk can no longer be
+        retrieved after this.
+        """
+        for f in (self._log, self._index, self._reader):
+            if f is not None:
+                f.close()
+        self._log = self._index = self._reader = None
+
+    def _rotate(self):
+        """
+        Cut the log down to the latest max_records notifications while running.
+        """
+        dropped = len(self._offsets) - self.max_records
+        for f in (self._log, self._index, self._reader):
+            f.close()
+        index_path = self._path + '.idx'
+        try:
+            self._compact(self._path, index_path, self.max_records)
+            self._log = open(self._path, 'ab')
+            self._index = open(index_path, 'ab')
+            self._reader = open(self._path, 'rb')
+        except OSError as e:
+            logger.exception(e)
+            self.close()
+            return
+        self._base += dropped
+
+    def _open(self, path, max_records):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        index_path = path + '.idx'
+        with open(path, 'ab'):
+            pass
+        self._log_size = os.path.getsize(path)
+
+        try:
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            self._offsets.frombytes(data[:len(data) - len(data) % self.offset.size])
+        except OSError:
+            pass
+        if not self._index_is_valid(path):
+            self._rebuild_index(path, index_path)
+
+        if len(self._offsets) > 2 * max_records:
+            self._compact(path, index_path, max_records)
+
+        self._count = len(self._offsets)
+        self._log = open(path, 'ab')
+        self._index = open(index_path, 'ab')
+        self._reader = open(path, 'rb')
+
+        first = max(0, self._count - self.size)
+        if first < self._count:
+            self._reader.seek(self._offsets[first])
+            for i in range(first, self._count):
+                self._ring[i % self.size] = self._read_record(self._reader)
+
+    def _index_is_valid(self, path):
+        if not self._offsets:
+            return self._log_size == 0
+        last = self._offsets[-1]
+        if last + self.record.size > self._log_size:
+            return False
+        with open(path, 'rb') as f:
+            f.seek(last)
+            length, = self.record.unpack(f.read(self.record.size))
+        return last + self.record.size + length == self._log_size
+
+    def _rebuild_index(self, path, index_path):
+        """
+        Recreate the index by skipping from one length prefix to the next. A partially
+        written record at the end of the log is cut off.
+        """
+        self._offsets = array('Q')
+        position = 0
+        with open(path, 'r+b') as f:
+            while position + self.record.size <= self._log_size:
+                f.seek(position)
+                length, = self.record.unpack(f.read(self.record.size))
+                end = position + self.record.size + length
+                if end > self._log_size:
+                    break
+                self._offsets.append(position)
+                position = end
+            if position != self._log_size:
+                f.truncate(position)
+                self._log_size = position
+        with open(index_path, 'wb') as f:
+            self._offsets.tofile(f)
+
+    def _compact(self, path, index_path, max_records):
+        """
+        Keep only the latest max_records notifications. These are a contiguous run at
+        the end of the log so they are copied across in one go.
+        """
+        start = self._offsets[-max_records]
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        self._offsets = array('Q', (o - start for o in self._offsets[-max_records:]))
+        with open(index_path + '.tmp', 'wb') as f:
+            self._offsets.tofile(f)
+        os.replace(path + '.tmp', path)
+        os.replace(index_path + '.tmp', index_path)
+        self._log_size = len(data)
+
+    def _read_record(self, f):
+        length, = self.record.unpack(f.read(self.record.size))
+        return self._decode(json.loads(f.read(length).decode()))
+
+    @staticmethod
+    def _encode(notif):
+        hints = {}
+        for hint in _SAVED_HINTS:
+            if hint in notif.hints:
+                value = notif.hints[hint]
+                hints[hint] = int(value) if isinstance(value, int) else str(value)
+        return {
+            'summary': str(notif.summary or ''),
+            'body': str(notif.body or ''),
+            'app_name': str(notif.app_name or ''),
+            'app_icon': str(notif.app_icon or ''),
+            'timeout': -1 if notif.timeout is None else int(notif.timeout),
+            'hints': hints,
+        }
+
+    @staticmethod
+    def _decode(record):
+        return Notification(
+            record['summary'],
+            record['body'],
+            record['timeout'],
+            record['hints'],
+            record['app_name'],
+            None,
+            record['app_icon'],
+        )
@@ -0,0 +1,124 @@
+"""
+Conversion of the raw pixel data sent in image-data hints into cairo surfaces.
+"""
+
+
+import hashlib
+import sys
+
+import cairocffi
+
+
+# Byte offsets of the red, green, blue and alpha channels within cairo's native-endian
+# 32 bit pixels.
+if sys.byteorder == 'little':
+    _R, _G, _B, _A = 2, 1, 0, 3
+else:
+    _R, _G, _B, _A = 1, 2, 3, 0
+
+
+def _view(data):
+    try:
+        return memoryview(data).cast('B')
+    except TypeError:
+        return memoryview(bytes(data))
+
+
+def image_data_key(image_data):
+    """
+    A digest identifying the image in an image-data hint, so that images can be cached
+    without holding on to their pixel data and notifications sending the same image
+    share cache entries.
+    """
+    *header, data = image_data
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([int(value) for value in header]).encode())
+    digest.update(_view(data))
+    return 'image-data', digest.digest()
+
+
+def surface_from_image_data(image_data, size):
+    """
+    Make an ARGB32 ImageSurface scaled to fit within a square of the given size from an
+    image-data hint, which is a tuple of (width, height, rowstride, has_alpha,
+    bits_per_sample, channels, data) describing RGB or RGBA bytes.
+
+    The colour channels are copied into a cairo RGB24 buffer and the alpha channel into
+    an A8 buffer using strided slices, so the work is done in bulk rather than per pixel
+    in Python, and cairo then scales and premultiplies both in a single paint. Returns
+    None if the data is in a format we can't handle.
+    """
+    width, height, rowstride, has_alpha, bits_per_sample, channels, data = image_data
+    width, height, rowstride = int(width), int(height), int(rowstride)
+    channels = int(channels)
+    if bits_per_sample != 8 or channels not in (3, 4) or width <= 0 or height <= 0:
+        return None
+    if channels != (4 if has_alpha else 3):
+        return None
+
+    view = _view(data)
+    row_bytes = width * channels
+    if len(view) < rowstride * (height - 1) + row_bytes:
+        return None
+
+    stride = cairocffi.ImageSurface.format_stride_for_width(
+        cairocffi.FORMAT_RGB24, width
+    )
+    rgb = bytearray(stride * height)
+    alpha = None
+    alpha_done = False
+    if has_alpha:
+        alpha_stride = cairocffi.ImageSurface.format_stride_for_width(
+            cairocffi.FORMAT_A8, width
+        )
+        alpha = bytearray(alpha_stride * height)
+
+    if rowstride == row_bytes and stride == width * 4:
+        # Tightly packed rows can be converted with one slice per channel.
+        pixels = view[:row_bytes * height]
+        rgb[_R::4] = pixels[0::channels]
+        rgb[_G::4] = pixels[1::channels]
+        rgb[_B::4] = pixels[2::channels]
+        if has_alpha and alpha_stride == width:
+            alpha[:] = pixels[3::4]
+            alpha_done = True
+    else:
+        for y in range(height):
+            row = view[y * rowstride:y * rowstride + row_bytes]
+            start = y * stride
+            end = start + width * 4
+            rgb[start + _R:end:4] = row[0::channels]
+            rgb[start + _G:end:4] = row[1::channels]
+            rgb[start + _B:end:4] = row[2::channels]
+
+    if has_alpha and not alpha_done:
+        for y in range(height):
+            start = y * rowstride
+            alpha[y * alpha_stride:y * alpha_stride + width] = \
+                view[start + 3:start + row_bytes:4]
+
+    scale = size / max(width, height)
+    surface = cairocffi.ImageSurface(
+        cairocffi.FORMAT_ARGB32,
+        max(1, round(width * scale)),
+        max(1, round(height * scale)),
+    )
+    ctx = cairocffi.Context(surface)
+    ctx.scale(scale, scale)
+    ctx.set_source_surface(
+        cairocffi.ImageSurface.create_for_data(
+            rgb, cairocffi.FORMAT_RGB24, width, height, stride
+        ),
+        0, 0,
+    )
+    if alpha is not None and alpha.count(b'\xff') != len(alpha):
+        ctx.mask_surface(
+            cairocffi.ImageSurface.create_for_data(
+                alpha, cairocffi.FORMAT_A8, width, height, alpha_stride
+            ),
+            0, 0,
+        )
+    else:
+        ctx.paint()
+    surface.flush()
+    return surface
@@ -0,0 +1,36 @@
+"""
+Helpers used by the notification server to keep bursts of notifications under control.
+"""
+
+
+class TokenBucket:
+    """
+    A token bucket that refills at rate tokens per second up to capacity tokens. Each
+    call to take that succeeds removes one token.
+    """
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = now
+
+    def take(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Burst:
+    """
+    A run of notifications from the same app with the same summary that arrived within
+    the coalescing window of each other. notif is the latest notification of the burst,
+    and shown is the one that is currently drawn or queued to represent it.
+    """
+    def __init__(self, notif, now):
+        self.notif = notif
+        self.shown = notif
+        self.count = 1
+        self.last = now
@@ -8,17 +8,45 @@ Example usage:
     keys.extend([EzKey(k, v) for k, v in {
         'M-<grave>':    notifier.lazy_prev,
         'M-S-<grave>':  notifier.lazy_next,
+        'M-C-<grave>':  notifier.lazy_search,
         'C-<space>':    notifier.lazy_close,
     }.items()])
 
 """
 
 
-from libqtile import configurable, hook, images, pangocffi, qtile
+import asyncio
+import os
+import subprocess
+import time
+from collections import namedtuple
+from functools import partial
+from urllib.parse import unquote
+
+from libqtile import configurable, hook, pangocffi, qtile
 from libqtile.lazy import lazy
 from libqtile.log_utils import logger
 from libqtile.notify import notifier
 from libqtile.popup import Popup
+from libqtile.utils import get_cache_dir
+
+from .cache import IconDiskCache, LRUCache, decode_icon, snapshot, surface_size
+from .events import EventStream
+from .history import History
+from .image_data import image_data_key, surface_from_image_data
+from .limits import Burst, TokenBucket
+from .queue import NotificationQueue, get_urgency
+from .search import SearchIndex
+from .stats import BUCKETS, Stats
+from .timers import TimerHeap
+
+
+# pangocffi doesn't export PANGO_ELLIPSIZE_NONE.
+_ELLIPSIZE_NONE = 0
+
+_HISTORY = os.path.join(get_cache_dir(), 'qtools_notifications.log')
+
+_Geometry = namedtuple('_Geometry', ('x', 'y', 'width', 'height'))
 
 
 class Server(configurable.Configurable):
@@ -27,12 +55,38 @@ class Server(configurable.Configurable):
     org.freedesktop.Notifications service implemented in libqtile.notify.
 
     Hints can be provided by notification clients to modify behaviour:
-        hint    behaviour
+        hint        behaviour
+        image-data  Raw image data to show in place of the app icon.
+        image-path  Path or file:// URI of an image to show in place of the app icon.
+        value       Percentage drawn as a progress bar at the bottom of the popup.
+
+    When a notification replaces one that only differs in its progress value, just the
+    progress bar is repainted and copied to the window.
 
     The format option determines what text is shown on the popup windows, and supports
     markup and new line characters e.g. '<b>{summary}</b>\n{body}'. Available
     placeholders are summary, body and app_name.
 
+    The text of each notification is laid out once. The overflow option decides what
+    happens to text that doesn't fit: 'truncate' ellipsizes long lines and cuts off
+    extra lines, 'more_width' widens the popup to fit the longest line and
+    'more_height' wraps lines and makes the popup taller, each up to the size of the
+    screen. The line_spacing between lines is approximate, as it is added as a thin
+    spacer line.
+
+    The history browsed with prev and next keeps the latest history_size notifications
+    in memory, and replaces the ever-growing list in libqtile.notify.notifier. Unless
+    history_file is None, all notifications are also appended to that file, so older
+    notifications can be browsed without being held in memory, including those from
+    before Qtile was restarted. The file is cut down to the latest history_max_records
+    notifications whenever it holds twice that many.
+
+    The history can be searched with search, which takes a query or otherwise asks for
+    one using search_command, and shows the latest notification that contains every
+    word in the query. Searching again for the same query steps back through older
+    matches. Searches use an index that is built the first time and then kept up to
+    date as notifications arrive.
+
     Foreground and background colours can be specified either as tuples/lists of 3
     strings, corresponding to low, normal and critical urgencies, or just a single
     string which will then be used for all urgencies. The timeout and border options can
@@ -41,14 +95,54 @@ class Server(configurable.Configurable):
     The max_windows option limits how many popup windows can be drawn at a time. When
     more notifications are recieved while the maximum number are already drawn,
     notifications are queued and displayed when existing notifications are closed.
+    Popup windows are only created when they are needed and are reused for later
+    notifications on any screen. Windows that have not been used for
+    popup_idle_timeout milliseconds are destroyed. Server.pool_stats counts how many
+    windows have been created, reused and destroyed this way.
+    Queued notifications are displayed in order of decreasing urgency. If
+    critical_preempts is True, a critical notification that arrives while the maximum
+    number of windows are drawn takes the place of a visible non-critical one, which is
+    then put back at the front of the queue.
+
+    Rendered popups are kept in a cache that is limited to render_cache_size bytes, so
+    that notifications that are shown repeatedly, for example when browsing the history,
+    are painted in one step rather than being laid out and drawn again. Set this to 0 to
+    disable the cache.
+
+    Icons are decoded in a thread so that large images do not block Qtile. Popups are
+    drawn straight away and their icon is added once it is ready. Decoded icons are
+    cached up to icon_cache_size bytes and are reloaded if the file is modified. If
+    icon_disk_cache is True, resized icons are also saved in Qtile's cache directory so
+    that they can be loaded quickly after a restart.
+
+    Notifications from the same app with the same summary that arrive within
+    coalesce_window milliseconds of each other are merged into a single popup showing
+    the latest body, with a counter added to the summary using coalesce_format. Each app
+    can also be limited to a number of notifications per second with rate_limit, which
+    takes a tuple of (rate, burst size) for a token bucket. Notifications over the limit
+    are dropped. Once max_queue is reached, the oldest of the least urgent queued
+    notifications are dropped to make room, or new ones if they are less urgent still.
+    Notifications replacing the same notification are drawn at most once every
+    replace_interval milliseconds, which defaults to about one frame, and of those that
+    arrive sooner only the latest is drawn once the interval is over.
+
+    The time spent on each stage of handling the latest stats_size notifications is
+    recorded, and can be retrieved along with queue, cache and pool counters with the
+    stats command to find out where the time goes when popups are slow to appear.
+
+    If event_socket is set to a path, a Unix socket is created there on which notify,
+    replace and close events are published as newline-delimited JSON objects, so that
+    other programs can follow notifications without polling Qtile. Each client has a
+    buffer of event_buffer events, and the oldest are dropped if it falls behind.
+
+    Popups are drawn with render_target, which is libqtile.popup.Popup by default.
+    OffscreenPopup can be used instead to draw them into memory without an X
+    connection, and OffscreenRenderer uses it to render notifications to images.
 
     TODO:
-        - overflow
         - select screen / follow mouse/keyboard focus
-        - critical notifications to replace any visible non-critical notifs immediately?
-        - hints: image-path, desktop-entry (for icon)
+        - hints: desktop-entry (for icon)
         - hints: Server parameters set for single notification?
-        - hints: progress value e.g. int:value:42 with drawing
 
     """
     defaults = [
@@ -86,34 +180,78 @@ class Server(configurable.Configurable):
         ('text_alignment', 'left', 'Text alignment: left, center or right.'),
         ('horizontal_padding', None, 'Padding at sides of text.'),
         ('vertical_padding', None, 'Padding at top and bottom of text.'),
-        ('line_spacing', 4, 'Space between lines.'),
+        ('line_spacing', 4, 'Approximate space between lines.'),
         (
             'overflow',
             'truncate',
             'How to deal with too much text: more_width, more_height, or truncate.',
         ),
         ('max_windows', 2, 'Maximum number of windows to show at once.'),
+        ('popup_idle_timeout', 60000, 'Milliseconds before idle windows are closed.'),
+        ('critical_preempts', False, 'Whether critical notifications replace others.'),
+        ('max_queue', 64, 'Maximum number of notifications to hold in the queue.'),
+        ('coalesce_window', 1000, 'Milliseconds within which to merge bursts, or 0.'),
+        ('coalesce_format', '{summary} ({count})', 'Summary format for merged bursts.'),
+        ('rate_limit', None, 'Per-app (rate, burst size) token bucket limit, or None.'),
+        ('replace_interval', 16, 'Milliseconds between redraws of replacements, or 0.'),
         ('gap', 12, 'Vertical gap between popup windows.'),
         ('sticky_history', True, 'Disable timeout when browsing history.'),
+        ('history_size', 256, 'Number of notifications to keep in memory.'),
+        ('history_file', _HISTORY, 'File to save notification history to, or None.'),
+        ('history_max_records', 10000, 'Number of notifications to keep in the file.'),
+        (
+            'search_command',
+            ['rofi', '-dmenu', '-l', '0', '-p', 'Search notifications'],
+            'Command used to ask for a search query.',
+        ),
         ('icon_size', 36, 'Pixel size of any icons.'),
+        ('progress_height', 6, 'Pixel height of progress bars.'),
+        ('progress_colour', None, 'Colour of progress bars, or None for foreground.'),
+        ('render_cache_size', 4194304, 'Bytes used to cache rendered popups.'),
+        ('icon_cache_size', 1048576, 'Bytes used to cache decoded icons.'),
+        ('icon_disk_cache', True, 'Whether to save resized icons to the cache dir.'),
+        ('stats_size', 256, 'Number of notifications to keep stage timings for.'),
+        ('render_target', Popup, 'Popup class used to draw notifications.'),
+        ('event_socket', None, 'Path of a Unix socket to publish events on, or None.'),
+        ('event_buffer', 256, 'Number of events to buffer for each socket client.'),
         ('fullscreen', 'show', 'What to do when in fullscreen: show, hide, or queue.'),
         ('screen', 'focus', 'How to select a screen: focus, mouse, or an int.'),
     ]
-    capabilities = {'body', 'body-markup', 'actions'}
+    capabilities = {'body', 'body-markup', 'actions', 'icon-static'}
     # specification: https://developer.gnome.org/notification-spec/
 
     def __init__(self, **config):
         configurable.Configurable.__init__(self, **config)
         self.add_defaults(Server.defaults)
         self._hidden = []
+        self._popup_config = {}
+        self._pool_stats = {'created': 0, 'reused': 0, 'evicted': 0}
         self._shown = []
-        self._queue = []
-        self._positions = []
+        self._queue = NotificationQueue()
         self._scroll_popup = None
         self._current_id = 0
         self._notif_id = None
+        self._history = None
+        self._screen_geometry = None
+        self._reposition_pending = False
+        self._search = SearchIndex()
+        self._query = None
+        self._matches = []
         self._paused = False
-        self._icons = {}
+        self._icons = LRUCache(self.icon_cache_size)
+        self._icons_loading = set()
+        self._icons_disk = None
+        self._renders = LRUCache(self.render_cache_size)
+        self._extents = LRUCache(256)
+        self._timers = TimerHeap()
+        self._stats = Stats(self.stats_size)
+        self._events = None
+        self._bursts = {}
+        self._replacements = {}
+        self._buckets = {}
+        self._counts = {}
+        self._coalesced = 0
+        self._dropped = 0
 
         self._make_attr_list('foreground')
         self._make_attr_list('background')
@@ -139,35 +277,103 @@ class Server(configurable.Configurable):
 
     def configure(self):
         """
-        This method needs to be called to set up the Server with the Qtile manager and
-        create the required popup windows.
+        This method needs to be called to set up the Server with the Qtile manager.
+        """
+        self._configure_popups()
+
+        if self.icon_disk_cache:
+            try:
+                self._icons_disk = IconDiskCache(
+                    os.path.join(get_cache_dir(), 'qtools_icons')
+                )
+            except OSError as e:
+                logger.exception(e)
+
+        self._history = History(
+            self.history_size, self.history_file, self.history_max_records
+        )
+        for notif in notifier.notifications:
+            self._history.append(notif)
+        notifier.notifications = self._history
+        hook.subscribe.shutdown(self._history.close)
+        hook.subscribe.restart(self._history.close)
+
+        if self.event_socket:
+            try:
+                self._events = EventStream(self.event_socket, self.event_buffer)
+            except OSError as e:
+                logger.exception(e)
+            else:
+                qtile.call_soon(asyncio.ensure_future, self._events.start())
+                hook.subscribe.shutdown(self._events.close)
+
+        hook.subscribe.screen_change(self._screens_changed)
+        hook.subscribe.current_screen_change(self._screens_changed)
+
+        notifier.register(self._receive, Server.capabilities)
+
+    def _configure_popups(self):
+        """
+        Work out the config passed on to popups, which is all that is needed to draw
+        notifications.
         """
         if self.horizontal_padding is None:
             self.horizontal_padding = self.font_size / 2
         if self.vertical_padding is None:
             self.vertical_padding = self.font_size / 2
 
-        popup_config = {}
         for opt in Popup.defaults:
             key = opt[0]
             if hasattr(self, key):
                 value = getattr(self, key)
                 if isinstance(value, (tuple, list)):
-                    popup_config[key] = value[1]
+                    self._popup_config[key] = value[1]
                 else:
-                    popup_config[key] = value
-
-        for win in range(self.max_windows):
-            popup = Popup(qtile, **popup_config)
-            popup.win.handle_ButtonPress = self._buttonpress(popup)
-            popup.replaces_id = None
-            self._hidden.append(popup)
-            self._positions.append(
-                (self.x, self.y + win * (self.height + 2 * self.border_width +
-                                         self.gap))
+                    self._popup_config[key] = value
+
+    def _get_popup(self):
+        """
+        Take an idle popup window from the pool, or create one if fewer than max_windows
+        exist. Returns None if all windows are in use.
+        """
+        if self._hidden:
+            self._pool_stats['reused'] += 1
+            return self._hidden.pop()
+        if len(self._shown) >= self.max_windows:
+            return None
+        popup = self.render_target(
+            qtile, width=self.width, height=self.height, **self._popup_config
+        )
+        popup.win.handle_ButtonPress = self._buttonpress(popup)
+        popup.replaces_id = None
+        popup.notif = None
+        self._pool_stats['created'] += 1
+        return popup
+
+    def _release(self, popup):
+        """
+        Return a popup window to the pool. It is destroyed if it stays unused for
+        popup_idle_timeout milliseconds.
+        """
+        self._hidden.append(popup)
+        if self.popup_idle_timeout is not None:
+            self._timers.schedule(
+                popup, self.popup_idle_timeout / 1000, self._evict, popup
             )
 
-        notifier.register(self._notify, Server.capabilities)
+    def _evict(self, popup):
+        if popup in self._hidden:
+            self._hidden.remove(popup)
+            # The window's button handler holds on to the popup and this server. Qtile
+            # forgets the window itself once it has been destroyed.
+            del popup.win.handle_ButtonPress
+            popup.kill()
+            # Newer versions of Popup.kill finalize these already, and Drawer.finalize
+            # can't be called twice.
+            if popup.drawer.surface is not None:
+                popup.drawer.finalize()
+                popup.layout.finalize()
+            self._pool_stats['evicted'] += 1
 
     def _buttonpress(self, popup):
         def _(event):
@@ -175,13 +381,175 @@ class Server(configurable.Configurable):
                 self._close(popup)
         return _
 
-    def _notify(self, notif):
+    def _receive(self, notif):
         """
         This method is registered with the NotificationManager to handle notifications
-        received via dbus. They will either be drawn now or queued to be drawn soon.
+        received via dbus.
+        """
+        self._stats.begin()
+        if self._events is not None:
+            self._publish(notif)
+        try:
+            self._admit(notif)
+        finally:
+            self._stats.end()
+
+    def _publish(self, notif):
+        fields = History._encode(notif)
+        fields['id'] = notif.id
+        if notif.replaces_id:
+            fields['replaces_id'] = notif.replaces_id
+            self._events.publish('replace', fields)
+        else:
+            self._events.publish('notify', fields)
+
+    def _admit(self, notif):
+        """
+        Bursts are merged and apps are rate limited here before notifications are
+        passed on to self._notify.
+        """
+        if self._search.ready:
+            self._search.update(self._history)
+
+        now = time.monotonic()
+        if notif.replaces_id:
+            self._replace(notif, now)
+            return
+
+        key = (notif.app_name, notif.summary)
+        burst = self._bursts.get(key)
+        if burst and now - burst.last < self.coalesce_window / 1000:
+            if self._merge(burst, notif):
+                burst.last = now
+                return
+
+        if self.rate_limit:
+            bucket = self._buckets.get(notif.app_name)
+            if bucket is None:
+                bucket = TokenBucket(*self.rate_limit, now)
+                self._buckets[notif.app_name] = bucket
+            if not bucket.take(now):
+                self._dropped += 1
+                return
+
+        if self.coalesce_window:
+            if burst:
+                self._end_burst(key)
+            self._bursts[key] = Burst(notif, now)
+            if len(self._bursts) > 64:
+                for old_key, old in list(self._bursts.items()):
+                    if now - old.last >= self.coalesce_window / 1000:
+                        self._end_burst(old_key)
+        self._notify(notif)
+
+    def _replace(self, notif, now):
+        """
+        Pass on a replacement unless the same notification was replaced within
+        replace_interval, in which case it is held until the interval is over. Only the
+        latest held replacement is drawn, so a client sending a stream of updates costs
+        at most one redraw per interval.
+        """
+        if not self.replace_interval:
+            self._notify(notif)
+            return
+
+        window = self.replace_interval / 1000
+        key = notif.replaces_id
+        burst = self._replacements.get(key)
+        if burst is not None and now - burst.last < window:
+            if burst.notif is not burst.shown:
+                self._coalesced += 1
+            burst.notif = notif
+            if burst not in self._timers:
+                self._timers.schedule(
+                    burst, burst.last + window - now, self._flush_replacement, key
+                )
+            return
+
+        self._replacements[key] = Burst(notif, now)
+        if len(self._replacements) > 64:
+            for old_key, old in list(self._replacements.items()):
+                if now - old.last >= window and old not in self._timers:
+                    del self._replacements[old_key]
+        self._notify(notif)
+
+    def _flush_replacement(self, key):
+        burst = self._replacements.get(key)
+        if burst is None or burst.notif is burst.shown:
+            return
+        burst.shown = burst.notif
+        burst.last = time.monotonic()
+        self._notify(burst.notif)
+
+    def _merge(self, burst, notif):
+        """
+        Merge a notification into a burst that is still visible or queued. If the burst
+        is no longer around this returns False and nothing is merged.
+        """
+        if self._queue.replace(burst.shown, notif):
+            self._counts.pop(burst.shown, None)
+            burst.shown = notif
+        elif any(popup.notif is burst.shown for popup in self._shown):
+            if burst not in self._timers:
+                self._timers.schedule(
+                    burst, self.coalesce_window / 1000, self._flush, burst
+                )
+        else:
+            return False
+
+        if burst.notif is not burst.shown:
+            self._counts.pop(burst.notif, None)
+        burst.notif = notif
+        burst.count += 1
+        self._counts[notif] = burst.count
+        self._coalesced += 1
+        return True
+
+    def _flush(self, burst):
+        """
+        Redraw a visible burst with the latest notification merged into it. This happens
+        at most once per coalescing window so that bursts have a bounded cost.
+        """
+        if burst.shown is burst.notif:
+            return
+        for popup in self._shown:
+            if popup.notif is burst.shown:
+                self._shown.remove(popup)
+                self._send(burst.notif, popup)
+                self._reposition()
+                break
+        self._counts.pop(burst.shown, None)
+        burst.shown = burst.notif
+
+    def _end_burst(self, key):
+        burst = self._bursts.pop(key)
+        if burst in self._timers:
+            self._timers.cancel(burst)
+            self._flush(burst)
+        self._counts.pop(burst.shown, None)
+
+    def _enqueue(self, notif):
+        """
+        Queue a notification. When the queue is full, the oldest of the least urgent
+        queued notifications makes room for it, unless it is less urgent than all of
+        them, in which case it is dropped itself.
+        """
+        if len(self._queue) >= self.max_queue:
+            self._dropped += 1
+            lowest = self._queue.lowest_urgency()
+            if lowest is None or get_urgency(notif) < lowest:
+                return
+            self._queue.drop()
+        self._queue.append(notif)
+
+    def _notify(self, notif):
+        """
+        Handle a notification that has made it through self._receive. It will either be
+        drawn now or queued to be drawn soon.
         """
+        self._stats.mark('receive')
         if self._paused:
-            self._queue.append(notif)
+            self._enqueue(notif)
             return
 
         if qtile.current_window and qtile.current_window.fullscreen:
@@ -189,21 +557,61 @@ class Server(configurable.Configurable):
                 if self.fullscreen == 'queue':
                     if self._unfullscreen not in hook.subscriptions:
                         hook.subscribe.float_change(self._unfullscreen)
-                    self._queue.append(notif)
+                    self._enqueue(notif)
                 return
 
         if notif.replaces_id:
             for popup in self._shown:
-                if notif.replaces_id == popup.replaces_id:
-                    self._shown.remove(popup)
-                    self._send(notif, popup)
-                    self._reposition()
+                if self._replaces(notif, popup):
+                    if self._is_progress_update(popup.notif, notif):
+                        self._send(notif, popup)
+                    else:
+                        self._shown.remove(popup)
+                        self._send(notif, popup)
+                        self._reposition()
                     return
 
-        if self._hidden:
-            self._send(notif, self._hidden.pop())
+        popup = self._get_popup()
+        if popup is not None:
+            self._send(notif, popup)
+        elif self.critical_preempts and get_urgency(notif) == 2:
+            self._preempt(notif)
         else:
-            self._queue.append(notif)
+            self._enqueue(notif)
+
+    def _replaces(self, notif, popup):
+        """
+        Whether notif replaces the notification on popup. Clients may give either the ID
+        of that notification or the ID that it replaced in turn. The former is an ID
+        that the server gave out, so it is only matched for the same app, as other
+        clients choose their own IDs that may happen to be the same.
+        """
+        if notif.replaces_id == popup.replaces_id:
+            return True
+        return (
+            notif.replaces_id == getattr(popup.notif, 'id', None) and
+            notif.app_name == popup.notif.app_name
+        )
+
+    def _preempt(self, notif):
+        """
+        Draw a critical notification in place of the oldest visible notification of the
+        lowest urgency, which goes back to the front of the queue.
+        """
+        victim = None
+        for popup in self._shown:
+            if popup is self._scroll_popup or popup.notif is None:
+                continue
+            urgency = get_urgency(popup.notif)
+            if urgency < 2 and (victim is None or urgency < get_urgency(victim.notif)):
+                victim = popup
+        if victim is None:
+            self._enqueue(notif)
+            return
+        self._queue.appendleft(victim.notif)
+        self._shown.remove(victim)
+        self._send(notif, victim)
+        self._reposition()
 
     def _unfullscreen(self):
         """
@@ -218,58 +626,215 @@ class Server(configurable.Configurable):
         If we hold off temporarily on sending notifications and accumulate a queue, we
         should use this to the queue through self._notify again.
         """
-        queue = self._queue.copy()
+        queue = list(self._queue)
         self._queue.clear()
-        while queue:
-            self._notify(queue.pop(0))
+        for notif in queue:
+            self._notify(notif)
 
     def _send(self, notif, popup, timeout=None):
         """
         Draw the desired notification using the specified Popup instance.
         """
-        text = self._get_text(notif)
-        urgency = notif.hints.get('urgency', 1)
+        timing = self._stats.begin()
+        if not timing:
+            self._stats.mark('dispatch')
+        urgency = get_urgency(notif)
         self._current_id += 1
         popup.id = self._current_id
-        if popup not in self._shown:
-            self._shown.append(popup)
-        popup.x, popup.y = self._get_coordinates()
-        icon = self._load_icon(notif)
+        if popup in self._shown and self._is_progress_update(popup.notif, notif):
+            popup.notif = notif
+            self._draw_progress(popup, notif, damage=True)
+            self._stats.mark('draw')
+        else:
+            popup.notif = notif
+            if popup not in self._shown:
+                self._shown.append(popup)
+            popup.x, popup.y = self._get_coordinates()
+            self._render(notif, popup)
+            popup.place()
+            popup.unhide()
+            popup.draw()
+            self._stats.mark('x')
+        popup.replaces_id = notif.replaces_id
 
+        if timeout is None:
+            if notif.timeout is None or notif.timeout < 0:
+                timeout = self.timeout[urgency]
+            else:
+                timeout = notif.timeout
+        elif timeout < 0:
+            timeout = self.timeout[urgency]
+        if timeout > 0:
+            self._timers.schedule(popup, timeout / 1000, self._close, popup, popup.id)
+        else:
+            self._timers.cancel(popup)
+        if timing:
+            self._stats.end()
+
+    def _render(self, notif, popup):
+        """
+        Paint a notification onto a Popup's drawer, either from the render cache or by
+        drawing it from scratch. The popup still needs to be drawn to the window.
+        """
+        text = self._get_text(notif)
+        self._stats.mark('escape')
+        urgency = get_urgency(notif)
+        icon, icon_key = self._load_icon(notif)
+        self._stats.mark('icon')
         popup.background = self.background[urgency]
         popup.foreground = self.foreground[urgency]
-        popup.clear()
 
+        progress = self._get_progress(notif) is not None
+        max_width, max_height = self._get_max_size()
+        key = (text, urgency, icon_key, progress, max_width, max_height)
+        surface = self._renders.get(key)
+        if surface is None:
+            self._draw(popup, text, icon, progress, max_width, max_height)
+            if self.render_cache_size:
+                surface = snapshot(popup.drawer, popup.width, popup.height)
+                self._renders.put(key, surface, surface_size(surface))
+        else:
+            self._resize(popup, surface.get_width(), surface.get_height())
+            popup.draw_image(surface, 0, 0)
+
+        if progress:
+            self._draw_progress(popup, notif)
+
+        if self.border_width:
+            popup.set_border(self.border[urgency])
+        self._stats.mark('draw')
+
+    def _draw(self, popup, text, icon, progress, max_width, max_height):
+        """
+        Lay out the text of a notification in a single pass, size the popup to suit the
+        overflow option, then draw the text and icon onto the popup's drawer. If the
+        notification has a progress bar, space is left for it below the text.
+        """
+        reserved = self.progress_height + self.vertical_padding / 2 if progress else 0
+        x = self.horizontal_padding
+        if icon:
+            x += self.icon_size + self.horizontal_padding / 2
+        padding = x + self.horizontal_padding
+        width = self.width
+        height = self.height
+
+        layout = popup.layout
+        if self.line_spacing > 0:
+            spacer = '<span font_desc="{0}px">\u200b</span>'.format(self.line_spacing)
+            popup.text = text.replace('\n', '\n' + spacer + '\n')
+        else:
+            popup.text = text
+
+        if self.overflow == 'more_height':
+            layout.layout.set_ellipsize(_ELLIPSIZE_NONE)
+            layout.width = width - padding
+            key = (text, 'more_height', layout.width)
+            text_height = self._extents.get(key)
+            if text_height is None:
+                text_height = layout.height
+                self._extents.put(key, text_height, 1)
+            text_height += 2 * self.vertical_padding + reserved
+            height = min(max(height, int(text_height)), max_height)
+        else:
+            layout.layout.set_ellipsize(pangocffi.ELLIPSIZE_END)
+            if self.overflow == 'more_width':
+                key = (text, 'more_width')
+                text_width = self._extents.get(key)
+                if text_width is None:
+                    del layout.width
+                    text_width = layout.width
+                    self._extents.put(key, text_width, 1)
+                width = min(max(width, int(text_width + padding)), max_width)
+            layout.width = width - padding
+
+        self._stats.mark('layout')
+        self._resize(popup, width, height)
+        popup.clear()
         if icon:
             popup.draw_image(
                 icon[0],
                 self.horizontal_padding,
-                1 + (self.height - icon[1]) / 2,
+                1 + (height - icon[1]) / 2,
             )
-            popup.horizontal_padding += self.icon_size + self.horizontal_padding / 2
 
-        for num, line in enumerate(text.split('\n')):
-            popup.text = line
-            y = self.vertical_padding + num * (popup.layout.height + self.line_spacing)
-            popup.draw_text(y=y)
-        if self.border_width:
-            popup.set_border(self.border[urgency])
-        popup.place()
-        popup.unhide()
-        popup.draw()
-        popup.replaces_id = notif.replaces_id
-        if icon:
-            popup.horizontal_padding = self.horizontal_padding
+        ctx = popup.drawer.ctx
+        ctx.save()
+        ctx.rectangle(0, 0, width, height - self.vertical_padding - reserved)
+        ctx.clip()
+        popup.draw_text(x=x, y=self.vertical_padding)
+        ctx.restore()
 
-        if timeout is None:
-            if notif.timeout is None or notif.timeout < 0:
-                timeout = self.timeout[urgency]
-            else:
-                timeout = notif.timeout
-        elif timeout < 0:
-            timeout = self.timeout[urgency]
-        if timeout > 0:
-            qtile.call_later(timeout / 1000, self._close, popup, self._current_id)
+    def _get_progress(self, notif):
+        value = notif.hints.get('value')
+        if value is None:
+            return None
+        return min(max(int(value), 0), 100)
+
+    def _is_progress_update(self, old, new):
+        """
+        Whether new can be drawn over old by only repainting the progress bar.
+        """
+        if old is None or self._get_progress(old) is None:
+            return False
+        if self._get_progress(new) is None or get_urgency(old) != get_urgency(new):
+            return False
+        old_image, old_path = self._get_icon_source(old)
+        new_image, new_path = self._get_icon_source(new)
+        if old_image is not None or new_image is not None or old_path != new_path:
+            return False
+        return self._get_text(old) == self._get_text(new)
+
+    def _draw_progress(self, popup, notif, damage=False):
+        """
+        Paint a notification's progress bar. With damage=True, only the bar's rectangle
+        is then copied from the drawer to the window.
+        """
+        x = self.horizontal_padding
+        y = popup.height - self.vertical_padding - self.progress_height
+        width = popup.width - 2 * self.horizontal_padding
+        height = self.progress_height
+
+        drawer = popup.drawer
+        drawer.set_source_rgb(popup.background)
+        drawer.ctx.rectangle(x, y, width, height)
+        drawer.ctx.fill()
+        drawer.set_source_rgb(self.progress_colour or popup.foreground)
+        drawer.ctx.rectangle(x, y, width * self._get_progress(notif) / 100, height)
+        drawer.ctx.fill()
+
+        if damage:
+            self._draw_damage(popup, int(x), int(y), int(width), int(height))
+
+    def _draw_damage(self, popup, x, y, width, height):
+        """
+        Copy one rectangle of a popup's drawer to its window. Drawer.draw always copies
+        from the drawer's origin, so this uses its pixmap directly.
+        """
+        drawer = popup.drawer
+        if drawer._surface is None or drawer._gc is None:
+            drawer.draw()
+            return
+        drawer._paint()
+        qtile.conn.conn.core.CopyArea(
+            drawer._pixmap, drawer.wid, drawer._gc, x, y, x, y, width, height
+        )
+
+    def _resize(self, popup, width, height):
+        if popup.width != width:
+            popup.width = width
+        if popup.height != height:
+            popup.height = height
+
+    def _get_max_size(self):
+        """
+        Get the largest size that popups can grow to with the current overflow option.
+        """
+        screen = self._get_screen()
+        if self.overflow == 'more_width':
+            return max(self.width, screen.width - 2 * self.x), self.height
+        if self.overflow == 'more_height':
+            return self.width, max(self.height, screen.height - 2 * self.y)
+        return self.width, self.height
 
     def _get_text(self, notif):
         summary = ''
@@ -281,16 +846,55 @@ class Server(configurable.Configurable):
             body = pangocffi.markup_escape_text(notif.body)
         if notif.app_name:
             app_name = pangocffi.markup_escape_text(notif.app_name)
+        if notif in self._counts:
+            summary = self.coalesce_format.format(
+                summary=summary, count=self._counts[notif]
+            )
         return self.format.format(summary=summary, body=body, app_name=app_name)
 
-    def _get_coordinates(self):
-        x, y = self._positions[len(self._shown) - 1]
+    def _get_screen(self):
+        """
+        Get the geometry of the screen that popups are drawn on. This is cached until
+        the screens or the current screen change, or for the 'mouse' option, until the
+        mouse leaves the cached screen.
+        """
+        geometry = self._screen_geometry
+        if geometry is not None:
+            if self.screen != 'mouse':
+                return geometry
+            x, y = qtile.mouse_position
+            if geometry.x <= x <= geometry.x + geometry.width and \
+                    geometry.y <= y <= geometry.y + geometry.height:
+                return geometry
+
+        screen = None
         if isinstance(self.screen, int):
             screen = qtile.screens[self.screen]
-        elif self.screen == 'focus':
-            screen = qtile.current_screen
         elif self.screen == 'mouse':
             screen = qtile.find_screen(*qtile.mouse_position)
+        if screen is None:
+            screen = qtile.current_screen
+        geometry = _Geometry(screen.x, screen.y, screen.width, screen.height)
+        self._screen_geometry = geometry
+        return geometry
+
+    def _screens_changed(self, *args):
+        self._screen_geometry = None
+        self._reposition()
+
+    def _get_position(self, index):
+        """
+        Get the position of the popup at index within self._shown relative to the
+        screen. Popups are stacked downwards and can have different heights.
+        """
+        y = self.y
+        for shown in self._shown[:index]:
+            y += shown.height + 2 * self.border_width + self.gap
+        return self.x, y
+
+    def _get_coordinates(self):
+        x, y = self._get_position(len(self._shown) - 1)
+        screen = self._get_screen()
         return x + screen.x, y + screen.y
 
     def _close(self, popup, nid=None):
@@ -301,40 +905,195 @@ class Server(configurable.Configurable):
             if nid is not None and popup.id != nid:
                 return
             self._shown.remove(popup)
+            self._timers.cancel(popup)
+            if self._events is not None and popup.notif is not None:
+                self._events.publish('close', {'id': getattr(popup.notif, 'id', None)})
             if self._scroll_popup is popup:
                 self._scroll_popup = None
                 self._notif_id = None
             popup.hide()
             if self._queue and not self._paused:
-                self._send(self._queue.pop(0), popup)
+                self._send(self._queue.popleft(), popup)
             else:
-                self._hidden.append(popup)
+                self._release(popup)
         self._reposition()
 
     def _reposition(self):
-        for index, shown in enumerate(self._shown):
-            shown.x, shown.y = self._positions[index]
-            shown.place()
+        """
+        Move popups to fill any gaps left by closed or resized popups. This is deferred
+        so that any number of changes made in one go lead to a single pass.
+        """
+        if not self._reposition_pending:
+            self._reposition_pending = True
+            qtile.call_soon(self._flush_positions)
+
+    def _flush_positions(self):
+        """
+        Only popups whose position has changed are moved, then the X connection is
+        flushed once.
+        """
+        self._reposition_pending = False
+        if not self._shown:
+            return
+        screen = self._get_screen()
+        y = self.y + screen.y
+        for popup in self._shown:
+            x = self.x + screen.x
+            if popup.x != x or popup.y != y:
+                popup.x = x
+                popup.y = y
+                popup.place()
+            y += popup.height + 2 * self.border_width + self.gap
+        qtile.conn.flush()
+
+    def _get_icon_source(self, notif):
+        """
+        Find the image to use as a notification's icon. As in the specification,
+        image-data takes priority over image-path, which takes priority over app_icon.
+        This returns the image-data hint and the path, either of which can be None.
+        """
+        for hint in ('image-data', 'image_data', 'icon_data'):
+            if hint in notif.hints:
+                return notif.hints[hint], None
+        path = (
+            notif.hints.get('image-path') or notif.hints.get('image_path') or
+            notif.app_icon
+        )
+        if path and path.startswith('file://'):
+            path = unquote(path[7:])
+        return None, path or None
 
     def _load_icon(self, notif):
-        if not notif.app_icon:
-            return None
-        if notif.app_icon in self._icons:
-            return self._icons.get(notif.app_icon)
+        """
+        Get the icon for a notification if it has been decoded, otherwise start decoding
+        it in a thread and return None for now. Icons sent as image-data are converted
+        straight away as they are already in memory.
+
+        This returns the icon along with a key identifying that version of it for the
+        render cache, or (None, None) if there is no icon.
+        """
+        image_data, path = self._get_icon_source(notif)
+        if image_data is not None:
+            key = image_data_key(image_data)
+            entry = self._icons.get(key)
+            if entry is None:
+                surface = surface_from_image_data(image_data, self.icon_size)
+                if surface is None:
+                    entry = None, None
+                    self._icons.put(key, entry, 0)
+                else:
+                    entry = None, (surface, surface.get_height())
+                    self._icons.put(key, entry, surface_size(surface))
+            return entry[1], key if entry[1] else None
+
+        if not path:
+            return None, None
         try:
-            img = images.Img.from_path(notif.app_icon)
-            if img.width > img.height:
-                img.resize(width=self.icon_size)
-            else:
-                img.resize(height=self.icon_size)
-            surface, _ = images._decode_to_image_surface(
-                img.bytes_img, img.width, img.height
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        entry = self._icons.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1], (path, mtime) if entry[1] else None
+        if mtime is None:
+            logger.warning("qtools.notification: icon not found: {0}".format(path))
+            self._icons.put(path, (None, None), 0)
+            return None, None
+
+        if self._icons_disk is not None:
+            surface = self._icons_disk.load(path, mtime, self.icon_size)
+            if surface is not None:
+                icon = surface, surface.get_height()
+                self._icons.put(path, (mtime, icon), surface_size(surface))
+                return icon, (path, mtime)
+
+        if path not in self._icons_loading:
+            self._icons_loading.add(path)
+            future = qtile.run_in_executor(self._decode_icon, path, mtime)
+            # Handled through Qtile so that the X connection is flushed afterwards.
+            future.add_done_callback(
+                partial(qtile.call_soon, self._icon_loaded, path, mtime)
+            )
+        return None, None
+
+    def _decode_icon(self, path, mtime):
+        """
+        Decode an icon and save it to the disk cache. This is run in a thread.
+        """
+        surface = decode_icon(path, self.icon_size)
+        if self._icons_disk is not None:
+            surface = self._icons_disk.store(path, mtime, self.icon_size, surface)
+        return surface
+
+    def _icon_loaded(self, path, mtime, future):
+        """
+        Store a newly decoded icon and redraw any visible popups waiting for it. Adding
+        the icon can change a popup's size, so popups are placed again. Failures are
+        cached too so that the icon isn't decoded again for every notification.
+        """
+        self._icons_loading.discard(path)
+        try:
+            surface = future.result()
+        except Exception as e:
+            logger.warning(
+                "qtools.notification: could not load icon: {0}: {1}".format(path, e)
             )
-            self._icons[notif.app_icon] = surface, surface.get_height()
-        except (FileNotFoundError, images.LoadingError, IsADirectoryError) as e:
-            logger.exception(e)
-            self._icons[notif.app_icon] = None
-        return self._icons[notif.app_icon]
+            self._icons.put(path, (mtime, None), 0)
+            return
+
+        icon = surface, surface.get_height()
+        self._icons.put(path, (mtime, icon), surface_size(surface))
+        redrawn = False
+        for popup in self._shown:
+            if popup.notif and self._get_icon_source(popup.notif)[1] == path:
+                self._render(popup.notif, popup)
+                popup.place()
+                popup.draw()
+                redrawn = True
+        if redrawn:
+            self._reposition()
+
+    @property
+    def pool_stats(self):
+        """
+        Counts of popup windows created, reused from the pool, evicted after being idle,
+        and currently shown or idle.
+        """
+        stats = dict(self._pool_stats)
+        stats['shown'] = len(self._shown)
+        stats['idle'] = len(self._hidden)
+        return stats
+
+    @property
+    def pending_timers(self):
+        """
+        The number of popup timeouts, burst redraws and idle window evictions currently
+        scheduled.
+        """
+        return len(self._timers)
+
+    def stats(self, qtile=None):
+        """
+        Get timings in milliseconds of each stage of handling the latest notifications,
+        as histograms with the bucket limits in 'buckets', along with counters for the
+        queue, caches and popup windows.
+        """
+        return {
+            'notifications': self._stats.count,
+            'stages': self._stats.summary(),
+            'buckets': BUCKETS,
+            'queue': len(self._queue),
+            'dropped': self._dropped,
+            'coalesced': self._coalesced,
+            'timers': len(self._timers),
+            'pool': self.pool_stats,
+            'caches': {
+                'render': self._renders.stats(),
+                'icon': self._icons.stats(),
+                'extents': self._extents.stats(),
+            },
+        }
 
     def close(self, qtile=None):
         """
@@ -343,6 +1102,21 @@ class Server(configurable.Configurable):
         if self._shown:
             self._close(self._shown[0])
 
+    def dismiss(self, replaces_id):
+        """
+        Close the popup showing the notification that replaces_id refers to, as used by
+        qtools.Notifier.hide, along with any replacement of it that is being held back.
+        """
+        if not replaces_id:
+            return
+        burst = self._replacements.pop(replaces_id, None)
+        if burst is not None:
+            self._timers.cancel(burst)
+        for popup in self._shown:
+            if popup.replaces_id == replaces_id:
+                self._close(popup)
+                return
+
     def close_all(self, qtile=None):
         """
         Close all popup windows.
@@ -355,36 +1129,62 @@ class Server(configurable.Configurable):
         """
         Display the previous notification in the history.
         """
-        if notifier.notifications:
+        if len(self._history) > self._history.first:
             if self._scroll_popup is None:
-                if self._hidden:
-                    self._scroll_popup = self._hidden.pop(0)
-                else:
-                    self._scroll_popup = self._shown[0]
-                self._notif_id = len(notifier.notifications)
-            if self._notif_id > 0:
-                self._notif_id -= 1
-            self._send(
-                notifier.notifications[self._notif_id],
-                self._scroll_popup,
-                0 if self.sticky_history else None,
-            )
+                self._notif_id = len(self._history)
+            self._show_history(max(self._notif_id - 1, self._history.first))
+
+    def _show_history(self, index):
+        if self._scroll_popup is None:
+            self._scroll_popup = self._get_popup() or self._shown[0]
+        self._notif_id = index
+        self._send(
+            self._history[index],
+            self._scroll_popup,
+            0 if self.sticky_history else None,
+        )
 
     def next(self, qtile=None):
         """
         Display the next notification in the history.
         """
         if self._scroll_popup:
-            if self._notif_id < len(notifier.notifications) - 1:
+            if self._notif_id < len(self._history) - 1:
                 self._notif_id += 1
+            self._notif_id = max(self._notif_id, self._history.first)
             if self._scroll_popup in self._shown:
                 self._shown.remove(self._scroll_popup)
             self._send(
-                notifier.notifications[self._notif_id],
+                self._history[self._notif_id],
                 self._scroll_popup,
                 0 if self.sticky_history else None,
             )
 
+    def search(self, qtile=None, query=None):
+        """
+        Display the latest notification in the history matching the query, or the next
+        older match if the query is the same as the last one.
+        """
+        if query is None:
+            output = subprocess.run(
+                self.search_command, stdout=subprocess.PIPE, universal_newlines=True,
+                check=False,
+            )
+            if output.returncode or not output.stdout.strip():
+                return
+            query = output.stdout.strip()
+
+        self._search.update(self._history)
+        if query == self._query and self._matches:
+            self._matches.pop()
+        else:
+            self._query = query
+            self._matches = self._search.search(query)
+        if self._matches:
+            self._show_history(self._matches[-1])
+        else:
+            self._query = None
+
     def pause(self, qtile=None):
         """
         Pause display of notifications on screen. Notifications will be queued and
@@ -0,0 +1,178 @@
+"""
+Rendering of notification popups into cairo image surfaces without an X connection.
+
+Example usage:
+
+    from libqtile.notify import Notification
+    from qtools.notification import OffscreenRenderer
+    renderer = OffscreenRenderer(format='<b>{summary}</b>\\n{body}')
+    renderer.render(Notification('Summary', 'Body'), 'notification.png')
+
+"""
+
+
+import os
+from concurrent.futures import Future
+
+import cairocffi
+from libqtile import configurable, pangocffi, utils
+from libqtile.drawer import Drawer
+from libqtile.popup import Popup
+
+from .notification import Server, _Geometry
+
+
+class OffscreenDrawer(Drawer):
+    """
+    A Drawer that paints onto an ImageSurface instead of an X pixmap. As with a
+    Drawer, operations are recorded until draw is called, which then paints them onto
+    the image.
+    """
+    def __init__(self, width, height):
+        Drawer.__init__(self, None, None, width, height)
+
+    def draw(self, offsetx=0, offsety=0, width=None, height=None):
+        if self._surface is None:
+            self._surface = cairocffi.ImageSurface(
+                cairocffi.FORMAT_ARGB32, self.width, self.height
+            )
+        self._paint()
+        self._surface.flush()
+
+
+class _OffscreenWindow:
+    """
+    Keeps track of the geometry and visibility that a popup's window would have.
+    """
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.hidden = True
+
+    def place(self, x, y, width, height, borderwidth, bordercolor, above=False):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def unhide(self):
+        self.hidden = False
+
+    def hide(self):
+        self.hidden = True
+
+    def kill(self):
+        self.hidden = True
+
+
+class OffscreenPopup(Popup):
+    """
+    A Popup that is drawn into memory. It can be used by Server in place of Popup with
+    the render_target option. After it is drawn, image is an ImageSurface of the popup
+    as it would appear on screen including its border, though without round corners or
+    opacity.
+    """
+    def __init__(self, qtile=None, x=50, y=50, width=256, height=64, **config):
+        configurable.Configurable.__init__(self, **config)
+        self.add_defaults(Popup.defaults)
+        self.qtile = qtile
+
+        self.win = _OffscreenWindow(x, y, width, height)
+        self.drawer = OffscreenDrawer(width, height)
+        self.layout = self.drawer.textlayout(
+            text='',
+            colour=self.foreground,
+            font_family=self.font,
+            font_size=self.font_size,
+            font_shadow=self.fontshadow,
+            wrap=self.wrap,
+            markup=True,
+        )
+        self.layout.layout.set_alignment(pangocffi.ALIGNMENTS[self.text_alignment])
+
+        self.x = x
+        self.y = y
+        if not self.border_width:
+            self.border = None
+
+    def set_border(self, color):
+        self.border = color
+
+    def unhide(self):
+        self.win.unhide()
+
+    @property
+    def image(self):
+        border_width = self.border_width if self.border else 0
+        image = cairocffi.ImageSurface(
+            cairocffi.FORMAT_ARGB32,
+            self.width + 2 * border_width,
+            self.height + 2 * border_width,
+        )
+        ctx = cairocffi.Context(image)
+        if border_width:
+            ctx.set_source_rgba(*utils.rgb(self.border))
+            ctx.paint()
+        if self.drawer._surface is not None:
+            ctx.set_source_surface(self.drawer._surface, border_width, border_width)
+            ctx.rectangle(border_width, border_width, self.width, self.height)
+            ctx.fill()
+        image.flush()
+        return image
+
+    def write_to_png(self, path):
+        self.image.write_to_png(path)
+
+
+class OffscreenRenderer:
+    """
+    Draws notifications exactly as a Server with the same config would, but into
+    ImageSurfaces, without needing Qtile or an X connection. This can be used to
+    measure rendering in isolation or to render many notifications in a batch. The
+    size of the screen that popups would be drawn on limits how far they can grow with
+    the overflow option. Icons are decoded in the calling thread.
+    """
+    def __init__(self, screen_width=1920, screen_height=1080, **config):
+        config['render_target'] = OffscreenPopup
+        config.setdefault('history_file', None)
+        config.setdefault('icon_disk_cache', False)
+        self.server = Server(**config)
+        self.server.screen = 0
+        self.server._screen_geometry = _Geometry(0, 0, screen_width, screen_height)
+        self.server._configure_popups()
+        self.popup = OffscreenPopup(
+            width=self.server.width,
+            height=self.server.height,
+            **self.server._popup_config
+        )
+
+    def _load_icon(self, notif):
+        server = self.server
+        image_data, path = server._get_icon_source(notif)
+        if image_data is not None or not path or path in server._icons:
+            return
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        future = Future()
+        try:
+            future.set_result(server._decode_icon(path, mtime))
+        except Exception as e:
+            future.set_exception(e)
+        server._icon_loaded(path, mtime, future)
+
+    def render(self, notif, path=None):
+        """
+        Render a notification, returning it as an ImageSurface and saving it as a PNG
+        if a path is given.
+        """
+        self._load_icon(notif)
+        self.server._render(notif, self.popup)
+        self.popup.draw()
+        image = self.popup.image
+        if path is not None:
+            image.write_to_png(path)
+        return image
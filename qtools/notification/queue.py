@@ -0,0 +1,88 @@
+"""
+The queue that holds notifications waiting for a free popup window.
+"""
+
+
+from collections import deque
+
+
+def get_urgency(notif):
+    """
+    Get the urgency of a notification as an int from 0 (low) to 2 (critical).
+    """
+    return min(max(int(notif.hints.get('urgency', 1)), 0), 2)
+
+
+class NotificationQueue:
+    """
+    A queue with one FIFO deque per urgency level. Notifications are dequeued in order
+    of decreasing urgency, so a critical notification never waits behind low urgency
+    ones, and both adding and removing notifications take constant time.
+    """
+    def __init__(self):
+        self._queues = (deque(), deque(), deque())
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues)
+
+    def __iter__(self):
+        for q in reversed(self._queues):
+            yield from q
+
+    def __contains__(self, notif):
+        return any(notif in q for q in self._queues)
+
+    def append(self, notif):
+        self._queues[get_urgency(notif)].append(notif)
+
+    def appendleft(self, notif):
+        """
+        Put a notification at the front of its urgency's queue, e.g. to return one that
+        was taken off the screen before it could time out.
+        """
+        self._queues[get_urgency(notif)].appendleft(notif)
+
+    def popleft(self):
+        """
+        Remove and return the oldest notification of the highest urgency.
+        """
+        for q in reversed(self._queues):
+            if q:
+                return q.popleft()
+        raise IndexError('pop from an empty NotificationQueue')
+
+    def lowest_urgency(self):
+        """
+        Get the lowest urgency of the queued notifications, or None if there are none.
+        """
+        for urgency, q in enumerate(self._queues):
+            if q:
+                return urgency
+        return None
+
+    def drop(self):
+        """
+        Remove and return the oldest notification of the lowest urgency, to make space
+        when the queue is full.
+        """
+        for q in self._queues:
+            if q:
+                return q.popleft()
+        raise IndexError('drop from an empty NotificationQueue')
+
+    def replace(self, old, new):
+        """
+        Put new in the place of old, returning False if old is not in the queue.
+        """
+        for q in self._queues:
+            try:
+                index = q.index(old)
+            except ValueError:
+                continue
+            q[index] = new
+            return True
+        return False
+
+    def clear(self):
+        for q in self._queues:
+            q.clear()
@@ -0,0 +1,86 @@
+"""
+An inverted index used to search the notification history.
+"""
+
+
+import re
+from array import array
+from bisect import bisect_left
+
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower()) if text else []
+
+
+class SearchIndex:
+    """
+    Maps each word found in the summary, body and app_name of notifications to the
+    sorted history indices of the notifications containing it. The index is brought up
+    to date with update, which only looks at notifications added since the last call,
+    so a query never needs to scan the whole history.
+    """
+    def __init__(self):
+        self._postings = {}
+        self._indexed = 0
+        self._first = 0
+        self._pruned = 0
+        self.ready = False
+
+    def update(self, history):
+        """
+        Index any notifications that have been added to history since the last update.
+        """
+        self.ready = True
+        start = max(self._indexed, history.first)
+        for index in range(start, len(history)):
+            self.add(index, history[index])
+        self._indexed = len(history)
+        self._first = history.first
+        if self._first - self._pruned > 1024:
+            self._prune()
+
+    def add(self, index, notif):
+        words = set(tokenize(notif.summary))
+        words.update(tokenize(notif.body))
+        words.update(tokenize(notif.app_name))
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = array('I')
+            postings.append(index)
+
+    def _prune(self):
+        """
+        Forget notifications that have fallen out of the history.
+        """
+        for word in list(self._postings):
+            postings = self._postings[word]
+            cut = bisect_left(postings, self._first)
+            if cut == len(postings):
+                del self._postings[word]
+            elif cut:
+                del postings[:cut]
+        self._pruned = self._first
+
+    def search(self, query):
+        """
+        Get the sorted history indices of notifications containing every word in query.
+        """
+        words = set(tokenize(query))
+        if not words:
+            return []
+        postings = []
+        for word in words:
+            if word not in self._postings:
+                return []
+            postings.append(self._postings[word])
+        postings.sort(key=len)
+        matches = set(postings[0])
+        for other in postings[1:]:
+            matches.intersection_update(other)
+            if not matches:
+                return []
+        return sorted(i for i in matches if i >= self._first)
@@ -0,0 +1,97 @@
+"""
+Timing of the stages that notifications go through in the notification server.
+"""
+
+
+import math
+import time
+from array import array
+
+
+# Stages in the order they happen. receive covers coalescing and rate limiting,
+# dispatch covers finding or creating a popup window, escape covers formatting the
+# text, layout covers Pango laying out the text, draw covers painting the popup and x
+# covers the X requests that place, map and draw the window.
+STAGES = ('receive', 'dispatch', 'escape', 'icon', 'layout', 'draw', 'x', 'total')
+
+# Upper bounds in milliseconds of the histogram buckets. The last bucket has no limit.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
+_INDEX = {stage: i for i, stage in enumerate(STAGES)}
+_TOTAL = _INDEX['total']
+
+
+class Stats:
+    """
+    A fixed-size buffer of the time spent in each stage for the latest size
+    notifications. Timing a notification costs a few calls to time.perf_counter, so
+    this can always be left on. Stages that a notification skips, for example because
+    it was drawn from a cache, are not counted for it.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self._times = array('d', [math.nan]) * (size * len(STAGES))
+        self._offset = None
+        self._start = 0
+        self._last = 0
+
+    def begin(self):
+        """
+        Start timing a notification. Returns False if one is already being timed, in
+        which case later stages are counted towards that one.
+        """
+        if self._offset is not None or not self.size:
+            return False
+        self._offset = (self.count % self.size) * len(STAGES)
+        for i in range(self._offset, self._offset + len(STAGES)):
+            self._times[i] = math.nan
+        self._start = self._last = time.perf_counter()
+        return True
+
+    def mark(self, stage):
+        """
+        Count the time since the last mark towards stage.
+        """
+        if self._offset is None:
+            return
+        now = time.perf_counter()
+        i = self._offset + _INDEX[stage]
+        elapsed = now - self._last
+        previous = self._times[i]
+        self._times[i] = elapsed if math.isnan(previous) else previous + elapsed
+        self._last = now
+
+    def end(self):
+        if self._offset is None:
+            return
+        self._times[self._offset + _TOTAL] = time.perf_counter() - self._start
+        self._offset = None
+        self.count += 1
+
+    def summary(self):
+        """
+        Get a histogram and percentiles in milliseconds for each stage.
+        """
+        records = min(self.count, self.size)
+        summary = {}
+        for i, stage in enumerate(STAGES):
+            times = sorted(
+                t * 1000 for t in self._times[i:records * len(STAGES):len(STAGES)]
+                if not math.isnan(t)
+            )
+            histogram = [0] * (len(BUCKETS) + 1)
+            bucket = 0
+            for t in times:
+                while bucket < len(BUCKETS) and t > BUCKETS[bucket]:
+                    bucket += 1
+                histogram[bucket] += 1
+            summary[stage] = {'count': len(times), 'histogram': histogram}
+            if times:
+                summary[stage].update(
+                    mean=sum(times) / len(times),
+                    p50=times[len(times) // 2],
+                    p99=times[len(times) * 99 // 100],
+                    max=times[-1],
+                )
+        return summary
@@ -0,0 +1,103 @@
+"""
+A timer scheduler that keeps at most one timer on Qtile's event loop.
+"""
+
+
+import heapq
+import time
+from itertools import count
+
+from libqtile import qtile
+from libqtile.log_utils import logger
+
+
+class TimerHeap:
+    """
+    Callbacks are scheduled against a key, such as the popup they will close, and
+    scheduling a new callback for a key replaces its old one. Deadlines are kept in a
+    heap and only the earliest is handed to the event loop, so replaced and cancelled
+    callbacks never pile up as dead timers on the loop.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._heap = []
+        self._seq = count()
+        self._handle = None
+        self._handle_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, key, delay, callback, *args):
+        """
+        Call callback with args after delay seconds, replacing any callback already
+        scheduled for key.
+        """
+        deadline = time.monotonic() + delay
+        seq = next(self._seq)
+        self._entries[key] = seq, callback, args
+        heapq.heappush(self._heap, (deadline, seq, key))
+        self._compact()
+        self._arm()
+
+    def cancel(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._compact()
+            self._arm()
+
+    def clear(self):
+        self._entries.clear()
+        self._heap.clear()
+        self._arm()
+
+    def _is_live(self, item):
+        entry = self._entries.get(item[2])
+        return entry is not None and entry[0] == item[1]
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._entries) + 16:
+            self._heap = [item for item in self._heap if self._is_live(item)]
+            heapq.heapify(self._heap)
+
+    def _arm(self):
+        """
+        Make sure the event loop will wake us for the earliest live deadline. An
+        existing loop timer that is due no later than that is left alone, as it will
+        re-arm when it fires.
+        """
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+
+        if not self._heap:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            return
+
+        deadline = self._heap[0][0]
+        if self._handle is not None:
+            if self._handle_at <= deadline:
+                return
+            self._handle.cancel()
+        self._handle_at = deadline
+        self._handle = qtile.call_later(max(deadline - time.monotonic(), 0), self._fire)
+
+    def _fire(self):
+        self._handle = None
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != seq:
+                continue
+            del self._entries[key]
+            _, callback, args = entry
+            # One failing callback mustn't stop the others or leave nothing armed.
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("qtools.notification: timer callback failed")
+        self._arm()
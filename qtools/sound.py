@@ -0,0 +1,152 @@
+"""
+Playback of short sounds, such as those made when sending notifications.
+"""
+
+
+import asyncio
+
+from libqtile.log_utils import logger
+
+
+# The most sounds that can play at once. Sounds played beyond this are skipped.
+MAX_PLAYING = 4
+
+# The most idle players to keep ready for each sound.
+POOL_SIZE = 2
+
+Gst = None
+
+
+def _init_gst():
+    """
+    Import and initialise GStreamer the first time a sound is used. Returns False if
+    it isn't available.
+    """
+    global Gst
+    if Gst is None:
+        try:
+            import gi
+            gi.require_version('Gst', '1.0')
+            from gi.repository import Gst as _Gst
+        except (ImportError, ValueError) as e:
+            logger.warning("qtools.play_sound: GStreamer is unavailable: {0}".format(e))
+            Gst = False
+        else:
+            _Gst.init(None)
+            Gst = _Gst
+    return Gst is not False
+
+
+class _Player:
+    """
+    A playbin for one sound file. It is pre-rolled, i.e. paused at the start of the
+    file with the first buffers decoded, so that it starts playing straight away.
+    Messages from its bus are handled by the event loop whenever the bus's file
+    descriptor becomes readable, so nothing ever waits for playback to finish.
+    """
+    def __init__(self, path, pool):
+        self.path = path
+        self._pool = pool
+        self._loop = None
+        self._fd = None
+        self.playbin = Gst.ElementFactory.make('playbin', None)
+        self.playbin.props.uri = Gst.filename_to_uri(path)
+        self.bus = self.playbin.get_bus()
+        self.playbin.set_state(Gst.State.PAUSED)
+
+    def play(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+            self._fd = self.bus.get_pollfd().fd
+            self._loop.add_reader(self._fd, self._on_message)
+        result = self.playbin.set_state(Gst.State.PLAYING)
+        return result != Gst.StateChangeReturn.FAILURE
+
+    def _on_message(self):
+        while True:
+            message = self.bus.pop_filtered(
+                Gst.MessageType.EOS | Gst.MessageType.ERROR
+            )
+            if message is None:
+                return
+            if message.type == Gst.MessageType.ERROR:
+                error, _ = message.parse_error()
+                logger.warning("qtools.play_sound failed with file: {0}: {1}".format(
+                    self.path, error.message
+                ))
+                self._pool.finished(self, False)
+            else:
+                self._pool.finished(self, True)
+
+    def rewind(self):
+        """
+        Go back to the start of the file and pre-roll again.
+        """
+        self.playbin.set_state(Gst.State.PAUSED)
+        self.playbin.seek_simple(
+            Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, 0
+        )
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self._fd)
+            self._loop = None
+        self.playbin.set_state(Gst.State.NULL)
+
+
+class _Pool:
+    """
+    Idle players for each sound along with those that are playing. Players go back to
+    the pool when they finish, up to POOL_SIZE for each sound, and one is pre-rolled in
+    advance whenever the last idle player for a sound is taken.
+    """
+    def __init__(self):
+        self.idle = {}
+        self.playing = set()
+
+    def preload(self, path):
+        if not _init_gst():
+            return
+        idle = self.idle.setdefault(path, [])
+        if not idle:
+            idle.append(_Player(path, self))
+
+    def play(self, path):
+        if not _init_gst() or len(self.playing) >= MAX_PLAYING:
+            return
+        idle = self.idle.setdefault(path, [])
+        player = idle.pop() if idle else _Player(path, self)
+        if player.play():
+            self.playing.add(player)
+        else:
+            logger.warning("qtools.play_sound failed with file: {0}".format(path))
+            player.close()
+        self.preload(path)
+
+    def finished(self, player, success):
+        self.playing.discard(player)
+        idle = self.idle.setdefault(player.path, [])
+        if success and len(idle) < POOL_SIZE:
+            player.rewind()
+            idle.append(player)
+        else:
+            player.close()
+
+
+_pool = _Pool()
+
+
+def preload_sound(path):
+    """
+    Get a player ready for a sound file so that it plays without delay the first time.
+    """
+    _pool.preload(path)
+
+
+def play_sound(path):
+    """
+    Play an audio file. This accepts a full path to an audio file. It returns
+    immediately and the sound plays in the background, unless MAX_PLAYING sounds are
+    already playing, in which case it is skipped.
+    """
+    _pool.play(path)
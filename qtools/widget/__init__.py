@@ -1,2 +1,3 @@
 from .habit_tracker import HabitTracker
-__all__ = ('HabitTracker',)
+from .now_playing import NowPlaying
+__all__ = ('HabitTracker', 'NowPlaying')
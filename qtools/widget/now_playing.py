@@ -0,0 +1,73 @@
+from libqtile import bar, pangocffi
+from libqtile.widget import base
+
+from qtools.mpc.state import get_state
+
+
+class _Fields(dict):
+    def __missing__(self, key):
+        return ''
+
+
+class NowPlaying(base._TextBox):
+    """
+    Shows what MPD is playing.
+
+    Rather than polling MPD, this draws from an in-memory copy of its state that is
+    updated as soon as MPD reports a change. This copy is shared with any
+    qtools.mpc.Client for the same server, so they use only one connection between
+    them for watching MPD.
+
+    The format string can use any field of MPD's status and currentsong responses,
+    e.g. {Artist}, {Title}, {Album} or {volume}, as well as {symbol}, which is the
+    symbol for the current state. Fields that MPD doesn't give are left empty. The
+    widget is hidden when MPD is stopped or can't be reached, unless stopped_text or
+    disconnected_text are set.
+    """
+    defaults = [
+        ('host', '127.0.0.1', 'IP address of MPD server.'),
+        ('port', '6600', 'Port of MPD server.'),
+        ('socket', None, "Path to MPD's Unix socket, used instead of host and port."),
+        ('mpd_timeout', 5, 'Seconds to wait for MPD to respond.'),
+        ('max_backoff', 60, 'Maximum seconds to wait between reconnection attempts.'),
+        ('format', '{symbol} {Artist} - {Title}', 'Format of the text.'),
+        ('symbols', {'play': '▶', 'pause': '⏸'}, 'Symbols for each state.'),
+        ('stopped_text', '', 'Text shown when MPD is stopped.'),
+        ('disconnected_text', '', "Text shown when MPD can't be reached."),
+    ]
+
+    def __init__(self, **config):
+        base._TextBox.__init__(self, '', bar.CALCULATED, **config)
+        self.add_defaults(NowPlaying.defaults)
+        self.state = get_state(
+            self.host, self.port, self.socket, self.mpd_timeout, self.max_backoff
+        )
+
+    def timer_setup(self):
+        self.state.subscribe(self.refresh)
+        self.state.start()
+        self.refresh()
+
+    def _get_text(self):
+        if not self.state.synced:
+            return self.disconnected_text
+        state = self.state.status.get('state')
+        if state not in self.symbols:
+            return self.stopped_text
+        fields = _Fields(self.state.status)
+        fields.update(self.state.song)
+        if self.markup:
+            for key, value in fields.items():
+                fields[key] = pangocffi.markup_escape_text(value)
+        fields['symbol'] = self.symbols[state]
+        return self.format.format_map(fields)
+
+    def refresh(self):
+        text = self._get_text()
+        if text != self.text:
+            old_length = self.calculate_length()
+            self.text = text
+            if self.calculate_length() == old_length:
+                self.draw()
+            else:
+                self.bar.draw()